@@ -2,18 +2,39 @@ import os
 from flask import Flask, jsonify, request, abort
 from flask_cors import CORS
 from models import setup_db
-from auth.auth import requires_auth
-from models import GenderEnum, Actor, Movie, Crew
-from helpers.pagination import extract_pagination_params, get_per_page, paginated_request
+from auth.auth import AuthError, requires_auth
+from models import GenderEnum, Actor, Movie, Crew, actor_search, movie_search, model_counters, actor_serializer, \
+    movie_serializer, crew_serializer, embed_crew, embed_cast, embed_crew_members, load_related, actor_autocomplete, \
+    movie_autocomplete
+from helpers.pagination import extract_pagination_params, get_per_page, paginated_request, keyset_paginate, \
+    fetch_page, get_sort_column
+from helpers.counting import count_total, get_count_mode
+from helpers.includes import get_includes, get_fields
+from helpers.validation import ValidationError, validate_actor, validate_movie
+from helpers.bulk_import import DEFAULT_CHUNK_SIZE, get_chunk_size, import_ndjson
+from helpers.cache import cached_response, setup_cache
+from helpers.coalescing import coalesced
+from helpers.autocomplete import DEFAULT_LIMIT as AUTOCOMPLETE_LIMIT, MAX_LIMIT as MAX_AUTOCOMPLETE_LIMIT
+from helpers.conditional import conditional_get
+from helpers.profiling import setup_profiling
+from helpers.metrics import registry, setup_metrics
+from helpers.serialization import json_response
+from helpers.streaming import DEFAULT_BATCH_SIZE, get_export_format, iterate_rows, streamed_response, \
+    format_in_batches
 from helpers.string import is_empty_string
 
 RECORDS_PER_PAGE = 10
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', DEFAULT_CHUNK_SIZE))
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', DEFAULT_BATCH_SIZE))
 
 
 def create_app(testing=None, test_config=None):
     app = Flask(__name__)
     app.testing = testing
     setup_db(app)
+    setup_cache(app)
+    setup_profiling(app)
+    setup_metrics(app)
     CORS(app)
 
     @app.route('/')
@@ -32,46 +53,136 @@ def create_app(testing=None, test_config=None):
     def be_cool():
         return "Be cool, man, be coooool! You're almost a FSND grad!"
 
+    @app.route('/metrics')
+    def show_metrics():
+        if not registry.enabled:
+            abort(404)
+        return app.response_class(registry.exposition(), mimetype='text/plain; version=0.0.4')
+
     @app.route('/api/stats')
     @requires_auth('view:actors')
+    @cached_response('Movies', 'Actors', 'Crews')
+    @coalesced('Movies', 'Actors', 'Crews')
     def show_stats(payload):
-        return jsonify({'movies': Movie.query.count(), 'actors': Actor.query.count()})
+        return jsonify(model_counters.snapshot())
+
+    @app.route('/api/autocomplete')
+    @requires_auth('')
+    def autocomplete(payload):
+        '''
+        Actor names and movie titles starting with q, or with a later word starting with q
+        type=actors or type=movies limits the lookup, which needs view:actors or view:movies
+        without type every kind the token may view is searched
+        '''
+        prefix = request.args.get('q')
+        if prefix is None:
+            abort(422)
+        try:
+            limit = int(request.args.get('limit', AUTOCOMPLETE_LIMIT))
+        except ValueError:
+            abort(422)
+        if limit < 1 or limit > MAX_AUTOCOMPLETE_LIMIT:
+            abort(422)
+
+        kinds = {
+            'actors': ('view:actors', actor_autocomplete, 'name'),
+            'movies': ('view:movies', movie_autocomplete, 'title')
+        }
+        requested = request.args.get('type')
+        if requested is not None and requested not in kinds:
+            abort(422)
+
+        permissions = payload['permissions'] if 'permissions' in payload else []
+        result = {'success': True}
+        for kind, (permission, backend, key) in kinds.items():
+            if requested is not None and requested != kind:
+                continue
+            if permission not in permissions:
+                if requested is not None:
+                    abort(403)
+                continue
+            result[kind] = [{'id': record_id, key: text} for record_id, text in backend.suggest(prefix, limit)]
+
+        return json_response(result)
 
     @app.route('/api/actors')
     @requires_auth('view:actors')
+    @conditional_get('Actors', 'Crews')
+    @cached_response('Actors', 'Crews')
+    @coalesced('Actors', 'Crews')
     @paginated_request
     def show_actors(pagination, payload):
         gender_values = list(map(lambda value: int(value), request.args.getlist('genders[]')))
         name = request.args.get('name')
+        count_mode = get_count_mode(request.args.get('countMode'))
+        include_crew = 'crew' in get_includes({'crew'})
+        fields = get_fields(actor_serializer.keys)
         sort_function = None
 
         pagination['per_page'] = get_per_page(pagination['per_page'], RECORDS_PER_PAGE)
 
-        if 'sort_field' in pagination:
-            field = getattr(Actor, pagination['sort_field'])
-            sort_function = getattr(field, pagination['sort_order'])
-
         query = Actor.query
 
-        if sort_function is not None:
-            query = query.order_by(sort_function())
-
         if (gender_values is not None) and (len(gender_values) > 0):
             enum_objs = list(map(lambda value: GenderEnum(value), gender_values))
             query = query.filter(Actor.gender.in_(enum_objs))
 
+        relevance = None
         if is_empty_string(name):
-            query = query.filter(Actor.name.ilike('%' + name + '%'))
+            query, relevance = actor_search.filter(query, name)
+
+        if 'cursor' in pagination:
+            sort_field = pagination.get('sort_field', 'id')
+            sort_order = pagination.get('sort_order', 'asc')
+            per_page = pagination['per_page'] or RECORDS_PER_PAGE
+            get_sort_column(Actor, sort_field)
+            rows, next_cursor = keyset_paginate(actor_serializer.select(query, fields, extra=('id', sort_field)),
+                                                Actor, sort_field, sort_order, pagination['cursor'], per_page)
+
+            if 0 == len(rows):
+                abort(404)
+
+            actors = actor_serializer.to_dicts(rows, fields)
+            if include_crew:
+                embed_crew(actors, rows, Crew.actor_id)
+
+            return json_response({
+                'actors': actors,
+                'nextCursor': next_cursor,
+                'perPage': per_page,
+                'filters': {'genders': gender_values},
+                'sortField': sort_field,
+                'sortOrder': sort_order,
+                'success': True
+            })
+
+        if 'sort_field' in pagination:
+            field = getattr(Actor, pagination['sort_field'])
+            sort_function = getattr(field, pagination['sort_order'])
+
+        if sort_function is not None:
+            query = query.order_by(sort_function())
+        elif relevance is not None:
+            query = query.order_by(relevance)
 
         if (0 != pagination['per_page']) and (0 != pagination['current_page']):
-            actors = query.paginate(per_page=pagination['per_page'], page=pagination['current_page'])
+            rows = fetch_page(actor_serializer.select(query, fields, extra=('id',)), pagination['current_page'],
+                              pagination['per_page'])
 
-            if 0 == len(actors.items):
+            if 0 == len(rows):
                 abort(404)
 
-            return jsonify({
-                'actors': list(map(lambda actor: actor.format(), actors.items)),
-                'totalCount': actors.total,
+            total, count_mode = count_total(query, Actor, (('genders', tuple(gender_values)), ('name', name)),
+                                            count_mode)
+
+            actors = actor_serializer.to_dicts(rows, fields)
+            if include_crew:
+                embed_crew(actors, rows, Crew.actor_id)
+
+            return json_response({
+                'actors': actors,
+                'totalCount': total,
+                'countMode': count_mode,
                 'currentPage': pagination['current_page'],
                 'perPage': pagination['per_page'],
                 'filters': {'genders': gender_values},
@@ -80,44 +191,71 @@ def create_app(testing=None, test_config=None):
                 'success': True
             })
         else:
-            actors = query.all()
+            rows = iterate_rows(actor_serializer.select(query, fields, extra=('id',)), EXPORT_BATCH_SIZE,
+                                not_found_when_empty=True)
+            embed = (lambda records, batch: embed_crew(records, batch, Crew.actor_id)) if include_crew else None
+            actors = format_in_batches(rows, actor_serializer.formatter(fields), EXPORT_BATCH_SIZE, embed)
 
-            if 0 == len(actors):
-                abort(404)
+            return streamed_response(actors, lambda actor: actor, 'actors')
 
-            return jsonify({
-                'actors': list(map(lambda actor: actor.format(), actors)),
-            })
+    @app.route('/api/actors/export')
+    @requires_auth('view:actors')
+    def export_actors(payload):
+        export_format = get_export_format(request.args.get('format'))
+        fields = get_fields(actor_serializer.keys)
+        actors = iterate_rows(actor_serializer.select(Actor.query.order_by(Actor.id.asc()), fields), EXPORT_BATCH_SIZE)
+
+        return streamed_response(actors, actor_serializer.formatter(fields), 'actors', export_format)
+
+    @app.route('/api/actors/<int:actor_id>/movies')
+    @requires_auth('view:actors')
+    @conditional_get('Movies', 'Actors', 'Crews')
+    @cached_response('Movies', 'Actors', 'Crews')
+    @coalesced('Movies', 'Actors', 'Crews')
+    def show_actor_movies(payload, actor_id):
+        fields = get_fields(movie_serializer.keys)
+        actor = actor_serializer.select(Actor.query.filter(Actor.id == actor_id)).first()
+
+        if actor is None:
+            abort(404)
+
+        movies = load_related(movie_serializer, Crew.movie_id, Crew.actor_id, [actor_id], fields)
+        return json_response({
+            'actor': actor_serializer.formatter()(actor),
+            'movies': movies.get(actor_id, []),
+            'success': True
+        })
 
     @app.route('/api/actors', methods=['POST'])
     @requires_auth('create:actor')
     def create_actors(payload):
         print('New actor: ')
         print(request.json)
-        name = request.json['name']
-        age = int(request.json['age']) if 'age' in request.json else 0
-
-        if (name is None) or ('' == name) or (len(name) < 5):
-            print('Invalid name provided')
+        try:
+            fields = validate_actor(request.json)
+        except ValidationError as e:
+            print(e.message)
             abort(422)
 
-        if (age is None) or (3 > age) or (99 < age):
-            print('Invalid age provided')
-            abort(422)
+        new_artist = Actor(**fields)
+        result = new_artist.save_to_db()
 
-        try:
-            gender = GenderEnum(request.json['gender'])
-            new_artist = Actor(name=name, age=age, gender=gender)
-            result = new_artist.save_to_db()
+        return jsonify({
+            'success': result,
+            'artist': new_artist.format(),
+        })
 
-            return jsonify({
-                'success': result,
-                'artist': new_artist.format(),
-            })
+    @app.route('/api/actors/import', methods=['POST'])
+    @requires_auth('create:actor')
+    def import_actors(payload):
+        try:
+            chunk_size = get_chunk_size(request.args.get('chunkSize'), IMPORT_CHUNK_SIZE)
         except ValueError:
-            print('Invalid gender provided')
             abort(422)
 
+        report = import_ndjson(request.stream, Actor, validate_actor, chunk_size)
+        return jsonify(report.format())
+
     @app.route("/api/actors/<int:actor_id>", methods=['DELETE'])
     @requires_auth('delete:actor')
     def delete_actor(payload, actor_id):
@@ -151,54 +289,122 @@ def create_app(testing=None, test_config=None):
 
     @app.route('/api/movies')
     @requires_auth('view:movies')
+    @conditional_get('Movies', 'Actors', 'Crews')
+    @cached_response('Movies', 'Actors', 'Crews')
+    @coalesced('Movies', 'Actors', 'Crews')
     @paginated_request
     def show_movies(pagination, payload):
+        includes = get_includes({'crew', 'cast'})
+        fields = get_fields(movie_serializer.keys)
+        query = Movie.query
+
+        def embed(records, rows):
+            if 'crew' in includes:
+                embed_crew(records, rows, Crew.movie_id)
+            if 'cast' in includes:
+                embed_cast(records, rows)
+
         if 'get_all' in pagination:
-            movie_list = Movie.query.order_by(Movie.release.desc()).all()
-            return jsonify({
-                'movies': list(map(lambda movie: movie.format(), movie_list))
-            })
+            rows = iterate_rows(movie_serializer.select(query.order_by(Movie.release.desc()), fields, extra=('id',)),
+                                EXPORT_BATCH_SIZE)
+            movie_list = format_in_batches(rows, movie_serializer.formatter(fields), EXPORT_BATCH_SIZE,
+                                           embed if includes else None)
+
+            return streamed_response(movie_list, lambda movie: movie, 'movies')
         else:
             pagination['per_page'] = get_per_page(pagination['per_page'], RECORDS_PER_PAGE)
             title = request.args.get('title')
 
-            field = getattr(Movie, pagination['sort_field'])
-            sort_function = getattr(field, pagination['sort_order'])
-
-            query = Movie.query
-
-            if sort_function is not None:
-                query = query.order_by(sort_function())
-
+            relevance = None
             if is_empty_string(title):
-                query = query.filter(Movie.title.ilike('%' + title + '%'))
-
-            movies = query.paginate(per_page=pagination['per_page'], page=pagination['current_page'])
-            return jsonify({
-                'movies': list(map(lambda movie: movie.format(), movies.items)),
-                'totalCount': movies.total,
+                query, relevance = movie_search.filter(query, title)
+
+            if 'cursor' in pagination:
+                sort_field = pagination.get('sort_field', 'id')
+                sort_order = pagination.get('sort_order', 'asc')
+                per_page = pagination['per_page'] or RECORDS_PER_PAGE
+                get_sort_column(Movie, sort_field)
+                rows, next_cursor = keyset_paginate(movie_serializer.select(query, fields, extra=('id', sort_field)),
+                                                    Movie, sort_field, sort_order, pagination['cursor'], per_page)
+
+                if 0 == len(rows):
+                    abort(404)
+
+                movies = movie_serializer.to_dicts(rows, fields)
+                embed(movies, rows)
+
+                return json_response({
+                    'movies': movies,
+                    'nextCursor': next_cursor,
+                    'perPage': per_page,
+                    'sortField': sort_field,
+                    'sortOrder': sort_order,
+                    'success': True
+                })
+
+            if 'sort_field' in pagination or relevance is None:
+                field = getattr(Movie, pagination['sort_field'])
+                query = query.order_by(getattr(field, pagination['sort_order'])())
+            else:
+                query = query.order_by(relevance)
+
+            rows = fetch_page(movie_serializer.select(query, fields, extra=('id',)), pagination['current_page'],
+                              pagination['per_page'])
+            total, count_mode = count_total(query, Movie, (('title', title),),
+                                            get_count_mode(request.args.get('countMode')))
+
+            movies = movie_serializer.to_dicts(rows, fields)
+            embed(movies, rows)
+
+            return json_response({
+                'movies': movies,
+                'totalCount': total,
+                'countMode': count_mode,
                 'currentPage': pagination['current_page'],
                 'perPage': pagination['per_page'],
                 'success': True
             })
 
+    @app.route('/api/movies/export')
+    @requires_auth('view:movies')
+    def export_movies(payload):
+        export_format = get_export_format(request.args.get('format'))
+        fields = get_fields(movie_serializer.keys)
+        movies = iterate_rows(movie_serializer.select(Movie.query.order_by(Movie.id.asc()), fields), EXPORT_BATCH_SIZE)
+
+        return streamed_response(movies, movie_serializer.formatter(fields), 'movies', export_format)
+
+    @app.route('/api/movies/<int:movie_id>/cast')
+    @requires_auth('view:movies')
+    @conditional_get('Movies', 'Actors', 'Crews')
+    @cached_response('Movies', 'Actors', 'Crews')
+    @coalesced('Movies', 'Actors', 'Crews')
+    def show_movie_cast(payload, movie_id):
+        fields = get_fields(actor_serializer.keys)
+        movie = movie_serializer.select(Movie.query.filter(Movie.id == movie_id)).first()
+
+        if movie is None:
+            abort(404)
+
+        cast = load_related(actor_serializer, Crew.actor_id, Crew.movie_id, [movie_id], fields)
+        return json_response({
+            'movie': movie_serializer.formatter()(movie),
+            'cast': cast.get(movie_id, []),
+            'success': True
+        })
+
     @app.route('/api/movies', methods=['POST'])
     @requires_auth('create:movie')
     def create_movies(payload):
         print('New movie: ')
         print(request.json)
-        title = request.json['title']
-        release = int(request.json['releaseDate']) if 'releaseDate' in request.json else 0
-
-        if (title is None) or ('' == title) or (len(title) < 5):
-            print('Invalid title provided')
-            abort(422)
-
-        if (release is None) or (0 == release):
-            print('Invalid release provided')
+        try:
+            fields = validate_movie(request.json)
+        except ValidationError as e:
+            print(e.message)
             abort(422)
 
-        new_movie = Movie(title=title, release=release)
+        new_movie = Movie(**fields)
         result = new_movie.save_to_db()
 
         return jsonify({
@@ -206,6 +412,17 @@ def create_app(testing=None, test_config=None):
             'movie': new_movie.format(),
         })
 
+    @app.route('/api/movies/import', methods=['POST'])
+    @requires_auth('create:movie')
+    def import_movies(payload):
+        try:
+            chunk_size = get_chunk_size(request.args.get('chunkSize'), IMPORT_CHUNK_SIZE)
+        except ValueError:
+            abort(422)
+
+        report = import_ndjson(request.stream, Movie, validate_movie, chunk_size)
+        return jsonify(report.format())
+
     @app.route("/api/movies/<int:movie_id>", methods=['PATCH'])
     @requires_auth('edit:movie')
     def update_movie(payload, movie_id):
@@ -238,20 +455,78 @@ def create_app(testing=None, test_config=None):
 
     @app.route('/api/crews', methods=['GET'])
     @requires_auth('update:crew')
-    def get_crew_list(payload):
-        crew_list = Crew.query.all()
+    @conditional_get('Crews', 'Actors', 'Movies')
+    @cached_response('Crews', 'Actors', 'Movies')
+    @coalesced('Crews', 'Actors', 'Movies')
+    @paginated_request
+    def get_crew_list(pagination, payload):
+        includes = get_includes({'actor', 'movie'})
+        filters = []
+        for name, column in (('movie_id', Crew.movie_id), ('actor_id', Crew.actor_id)):
+            value = request.args.get(name)
+            if value is not None:
+                try:
+                    filters.append((column, int(value)))
+                except ValueError:
+                    abort(422)
+
+        query = Crew.query
+        for column, value in filters:
+            query = query.filter(column == value)
+        per_page = get_per_page(pagination['per_page'], RECORDS_PER_PAGE)
+
+        if 'cursor' in pagination:
+            sort_field = pagination.get('sort_field', 'id')
+            sort_order = pagination.get('sort_order', 'asc')
+            get_sort_column(Crew, sort_field)
+            rows, next_cursor = keyset_paginate(crew_serializer.select(query, extra=(sort_field,)), Crew,
+                                                sort_field, sort_order, pagination['cursor'], per_page)
+
+            if 0 == len(rows):
+                abort(404)
+
+            return json_response({
+                'crews': embed_crew_members(crew_serializer.to_dicts(rows), includes),
+                'nextCursor': next_cursor,
+                'perPage': per_page,
+                'sortField': sort_field,
+                'sortOrder': sort_order,
+                'success': True
+            })
+
+        if (request.args.get('page') is None and request.args.get('perPage') is None) or 0 == per_page:
+            # Without paging arguments, or with perPage=0, every crew is returned as before pagination existed
+            rows = iterate_rows(crew_serializer.select(query.order_by(Crew.id)), EXPORT_BATCH_SIZE,
+                                not_found_when_empty=True)
+            embed = (lambda records, batch: embed_crew_members(records, includes)) if includes else None
+            crews = format_in_batches(rows, crew_serializer.formatter(), EXPORT_BATCH_SIZE, embed)
+
+            return streamed_response(crews, lambda crew: crew, 'crews', extra={'success': True})
+
+        rows = fetch_page(crew_serializer.select(query.order_by(Crew.id)), pagination['current_page'], per_page)
 
-        if len(crew_list) == 0:
+        if len(rows) == 0:
             abort(404)
 
-        try:
-            return jsonify({
-                'crews': list(map(lambda crew: crew.format(), crew_list)),
-                'success': True,
-            })
-        except Exception as e:
-            print(e)
-            abort(422)
+        signature = tuple((column.key, value) for column, value in filters)
+        total, count_mode = count_total(query, Crew, signature, get_count_mode(request.args.get('countMode')))
+
+        return json_response({
+            'crews': embed_crew_members(crew_serializer.to_dicts(rows), includes),
+            'totalCount': total,
+            'countMode': count_mode,
+            'currentPage': pagination['current_page'],
+            'perPage': per_page,
+            'success': True,
+        })
+
+    @app.route('/api/crews/export')
+    @requires_auth('update:crew')
+    def export_crews(payload):
+        export_format = get_export_format(request.args.get('format'))
+        crews = iterate_rows(crew_serializer.select(Crew.query.order_by(Crew.id.asc())), EXPORT_BATCH_SIZE)
+
+        return streamed_response(crews, crew_serializer.formatter(), 'crews', export_format)
 
     @app.route('/api/crews', methods=['POST'])
     @requires_auth('update:crew')
@@ -264,24 +539,16 @@ def create_app(testing=None, test_config=None):
             print('No movie found')
             abort(422)
 
-        records = Crew.query.filter(Crew.movie_id == request.json['movie_id']).all()
-
-        if len(records) > 0:
-            for record in records:
-                record.delete_from_db()
+        if artist_list is None:
+            print('No artist list found')
+            abort(422)
 
-        if artist_list is not None:
-            try:
-                for val in artist_list:
-                    new_crew = Crew(actor_id=val, movie_id=movie_id)
-                    new_crew.save_to_db()
+        try:
+            added, removed = Crew.assign_to_movie(movie_id, [int(val) for val in artist_list])
 
-                return jsonify({'success': True, 'result': request.json})
-            except Exception as e:
-                print(e)
-                abort(422)
-        else:
-            print('No artist list found')
+            return jsonify({'success': True, 'result': request.json, 'added': added, 'removed': removed})
+        except Exception as e:
+            print(e)
             abort(422)
 
     # Error Handling
@@ -329,10 +596,28 @@ def create_app(testing=None, test_config=None):
             "message": "No permission granted"
         }), 403
 
+    @app.errorhandler(AuthError)
+    def auth_error(error):
+        return jsonify({
+            "success": False,
+            "error": error.status_code,
+            "message": error.error['description']
+        }), error.status_code
+
     return app
 
 
-app = create_app()
+'''
+app is created on first access (gunicorn app:app, from app import app) so importing this module stays cheap
+'''
+
+
+def __getattr__(name):
+    if 'app' == name:
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
 
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
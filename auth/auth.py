@@ -1,16 +1,41 @@
-import json
 from flask import request
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
 import os
 
+from auth.jwks import JWKSKeyStore, KeysUnavailable
+from auth.token_cache import VerifiedTokenCache
+from helpers.metrics import registry
+from helpers.profiling import profile_phase
+
 AUTH0_DOMAIN = ''
 if 'AUTH0_DOMAIN' in os.environ:
     AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'movie-udacity-api'
 
+'''
+JWKS key store
+    AUTH0_JWKS_URL overrides the Auth0 jwks location (e.g. file:///path/jwks.json for local runs)
+    JWKS_CACHE_TTL is the number of seconds keys are used before a background refresh
+    JWKS_MIN_REFRESH_INTERVAL limits how often an unknown kid can trigger a re-fetch
+'''
+
+jwks_store = JWKSKeyStore(
+    os.environ.get('AUTH0_JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json'),
+    ttl=int(os.environ.get('JWKS_CACHE_TTL', 600)),
+    min_refresh_interval=int(os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30))
+)
+
+'''
+Verified token cache
+    AUTH_TOKEN_CACHE_SIZE is the number of decoded tokens kept in memory, 0 disables the cache
+'''
+
+token_cache = VerifiedTokenCache(max_size=int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 1024)))
+registry.add_collector(lambda: {('auth_token_cache_hits_total', ()): token_cache.hits,
+                                 ('auth_token_cache_misses_total', ()): token_cache.misses})
+
 ## AuthError Exception
 '''
 AuthError Exception
@@ -79,6 +104,7 @@ check_permissions(permission, payload) method
     it should raise an AuthError if permissions are not included in the payload
         !!NOTE check your RBAC settings in Auth0
     it should raise an AuthError if the requested permission string is not in the payload permissions array
+    an empty permission only requires a valid token
     return true otherwise
 '''
 
@@ -89,7 +115,7 @@ def check_permissions(permission, payload):
             'code': 'invalid_claims',
             'description': 'Permissions not included in JWT.'
         }, 400)
-    if permission not in payload['permissions']:
+    if permission and permission not in payload['permissions']:
         raise AuthError({
             'code': 'unauthorized',
             'description': 'Permission not found.'
@@ -102,7 +128,7 @@ verify_decode_jwt(token) method
     @INPUTS
         token: a json web token (string)
     it should be an Auth0 token with key id (kid)
-    it should verify the token using Auth0 /.well-known/jwks.json
+    it should verify the token using Auth0 /.well-known/jwks.json (served from jwks_store)
     it should decode the payload from the token
     it should validate the claims
     return the decoded payload
@@ -111,10 +137,7 @@ verify_decode_jwt(token) method
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
 
     if 'kid' not in unverified_header:
         raise AuthError({
@@ -122,15 +145,13 @@ def verify_decode_jwt(token):
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    try:
+        rsa_key = jwks_store.get_key(unverified_header['kid'])
+    except KeysUnavailable:
+        raise AuthError({
+            'code': 'keys_unavailable',
+            'description': 'Unable to fetch the signing keys.'
+        }, 503)
 
     if rsa_key:
         try:
@@ -171,7 +192,8 @@ def verify_decode_jwt(token):
     @INPUTS
         permission: string permission (i.e. 'post:drink')
     it should use the get_token_auth_header method to get the token
-    it should use the verify_decode_jwt method to decode the jwt
+    it should reuse the payload from token_cache when the same token was verified before
+    it should use the verify_decode_jwt method to decode the jwt otherwise
     it should use the check_permissions method validate claims and check the requested permission
     return the decorator which passes the decoded payload to the decorated method
 '''
@@ -181,9 +203,13 @@ def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            with profile_phase('auth'):
+                token = get_token_auth_header()
+                payload = token_cache.get(token)
+                if payload is None:
+                    payload = verify_decode_jwt(token)
+                    token_cache.put(token, payload)
+                check_permissions(permission, payload)
             return f(payload, *args, **kwargs)
 
         return wrapper
@@ -0,0 +1,120 @@
+import json
+import sys
+import threading
+import time
+from urllib.request import urlopen
+
+'''
+JWKSKeyStore
+    keeps the signing keys published at a JWKS url in memory
+    keys are refreshed in the background once they are older than the ttl
+    an unknown kid triggers at most one synchronous re-fetch per min_refresh_interval
+    a failed first fetch is retried at most once per min_refresh_interval too, until then
+    get_key raises KeysUnavailable without touching the network
+    the url can be any location urlopen understands (https://, http://, file://)
+'''
+
+
+class KeysUnavailable(Exception):
+    pass
+
+
+class JWKSKeyStore:
+    def __init__(self, url, ttl=600, min_refresh_interval=30, timeout=5):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = None
+        self._refresh_lock = threading.Lock()
+        self._background_refresh = None
+
+    def fetch(self):
+        response = urlopen(self.url, timeout=self.timeout)
+        try:
+            jwks = json.loads(response.read())
+        finally:
+            response.close()
+
+        keys = {}
+        for key in jwks.get('keys', []):
+            if 'kid' not in key:
+                continue
+            keys[key['kid']] = {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key.get('use', 'sig'),
+                'n': key['n'],
+                'e': key['e']
+            }
+        return keys
+
+    def refresh(self):
+        self._last_attempt = time.monotonic()
+        keys = self.fetch()
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+        return keys
+
+    def clear(self):
+        with self._refresh_lock:
+            self._keys = {}
+            self._fetched_at = None
+            self._last_attempt = None
+
+    def is_stale(self, now=None):
+        if self._fetched_at is None:
+            return True
+        now = time.monotonic() if now is None else now
+        return now - self._fetched_at >= self.ttl
+
+    def get_key(self, kid):
+        if self._fetched_at is None:
+            if self._can_refetch():
+                self._refresh_once()
+            if self._fetched_at is None:
+                raise KeysUnavailable('No signing keys could be fetched from ' + self.url)
+        elif self.is_stale():
+            self._start_background_refresh()
+
+        key = self._keys.get(kid)
+        if key is None and self._can_refetch():
+            self._refresh_once()
+            key = self._keys.get(kid)
+        return key
+
+    def _can_refetch(self):
+        if self._last_attempt is None:
+            return True
+        return time.monotonic() - self._last_attempt >= self.min_refresh_interval
+
+    def _refresh_once(self):
+        # Only one thread fetches; the others wait and reuse its result, failed or not.
+        attempted_before = self._last_attempt
+        with self._refresh_lock:
+            if self._last_attempt != attempted_before:
+                return
+            try:
+                self.refresh()
+            except Exception:
+                print('Unable to refresh JWKS from ' + self.url)
+                print(sys.exc_info())
+
+    def _start_background_refresh(self):
+        with self._refresh_lock:
+            if self._background_refresh is not None and self._background_refresh.is_alive():
+                return
+            if not self._can_refetch():
+                return
+            self._last_attempt = time.monotonic()
+            self._background_refresh = threading.Thread(target=self._refresh_in_background, daemon=True)
+            self._background_refresh.start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            print('Unable to refresh JWKS from ' + self.url)
+            print(sys.exc_info())
@@ -0,0 +1,57 @@
+'''
+Microbenchmark for requires_auth
+    compares the per-request cost of a repeated bearer token with the verified token cache on and off
+
+    python benchmarks/auth_cache.py --requests 2000
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import configure_local_auth, make_token, summarize
+
+
+def run(requests, cache_size):
+    from flask import Flask
+    from auth import auth
+
+    app = Flask(__name__)
+    auth.token_cache.max_size = cache_size
+    auth.token_cache.clear()
+
+    @auth.requires_auth('view:actors')
+    def view(payload):
+        return payload
+
+    headers = {'Authorization': 'Bearer ' + TOKEN}
+    samples = []
+    for _ in range(requests):
+        with app.test_request_context('/api/actors', headers=headers):
+            started = time.perf_counter()
+            view()
+            samples.append(time.perf_counter() - started)
+
+    result = summarize(samples)
+    result.update(auth.token_cache.stats())
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='requires_auth with and without the token cache')
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    for label, cache_size in (('cache off', 0), ('cache on', 1024)):
+        result = run(args.requests, cache_size)
+        print('{:<10} mean={mean_ms:.4f}ms p50={p50_ms:.4f}ms p99={p99_ms:.4f}ms hits={hits} misses={misses}'
+              .format(label, **result))
+
+
+PRIVATE_KEY = configure_local_auth()
+TOKEN = make_token(PRIVATE_KEY, ['view:actors'])
+
+if __name__ == '__main__':
+    main()
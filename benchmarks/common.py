@@ -0,0 +1,129 @@
+import base64
+import json
+import os
+import tempfile
+import time
+
+from Crypto.PublicKey import RSA
+from jose import jwt
+
+'''
+Shared helpers for the benchmark scripts
+    local RSA signing key and jwks file so requires_auth runs without Auth0
+    a throwaway sqlite database seeded with bulk inserts when DATABASE_URL is not set
+'''
+
+BENCHMARK_DOMAIN = 'benchmark.local'
+BENCHMARK_KID = 'benchmark-key'
+
+
+def _base64url_uint(value):
+    length = (value.bit_length() + 7) // 8
+    return base64.urlsafe_b64encode(value.to_bytes(length, 'big')).rstrip(b'=').decode('ascii')
+
+
+def generate_signing_key(kid=BENCHMARK_KID):
+    key = RSA.generate(2048)
+    jwk = {
+        'kty': 'RSA',
+        'kid': kid,
+        'use': 'sig',
+        'n': _base64url_uint(key.n),
+        'e': _base64url_uint(key.e)
+    }
+    return key.export_key().decode('ascii'), jwk
+
+
+def write_jwks(jwk):
+    jwks_file = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+    json.dump({'keys': [jwk]}, jwks_file)
+    jwks_file.close()
+    return jwks_file.name
+
+
+def configure_local_auth():
+    '''
+    Points auth.auth at a freshly generated local key, must run before auth.auth is imported
+    returns the private key used to sign tokens
+    '''
+    private_key, jwk = generate_signing_key()
+    os.environ['AUTH0_DOMAIN'] = BENCHMARK_DOMAIN
+    os.environ['AUTH0_JWKS_URL'] = 'file://' + write_jwks(jwk)
+    return private_key
+
+
+def make_token(private_key, permissions, lifetime=3600, kid=BENCHMARK_KID):
+    now = int(time.time())
+    claims = {
+        'iss': 'https://' + BENCHMARK_DOMAIN + '/',
+        'sub': 'benchmark|user',
+        'aud': 'movie-udacity-api',
+        'iat': now,
+        'exp': now + lifetime,
+        'permissions': permissions
+    }
+    return jwt.encode(claims, private_key, algorithm='RS256', headers={'kid': kid})
+
+
+def configure_database():
+    '''
+    Uses DATABASE_URL when set, otherwise a new sqlite file, must run before models is imported
+    '''
+    if 'DATABASE_URL' not in os.environ:
+        database_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        database_file.close()
+        os.environ['DATABASE_URL'] = 'sqlite:///' + database_file.name
+    return os.environ['DATABASE_URL']
+
+
+def seed_database(actors, movies, crews, chunk_size=5000):
+    '''
+    Replaces the content of the configured database, needs an application context
+    every crew row links a pseudo random actor to a pseudo random movie, without duplicates
+    '''
+    import random
+    from models import db, Actor, Movie, Crew, GenderEnum
+
+    db.drop_all()
+    db.create_all()
+    generator = random.Random(42)
+    genders = list(GenderEnum)
+
+    def insert(table, rows):
+        for start in range(0, len(rows), chunk_size):
+            db.session.execute(table.insert(), rows[start:start + chunk_size])
+
+    insert(Actor.__table__, [
+        {'name': 'Actor {:06d}'.format(index), 'age': generator.randint(3, 99), 'gender': generator.choice(genders)}
+        for index in range(actors)
+    ])
+    insert(Movie.__table__, [
+        {'title': 'Movie {:06d}'.format(index), 'release': 946684800 + index * 86400}
+        for index in range(movies)
+    ])
+    if actors and movies:
+        # Assignments are unique per (movie, actor)
+        pairs = set()
+        while len(pairs) < min(crews, actors * movies):
+            pairs.add((generator.randint(1, movies), generator.randint(1, actors)))
+        insert(Crew.__table__, [{'movie_id': movie_id, 'actor_id': actor_id} for movie_id, actor_id in pairs])
+    db.session.commit()
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    total = sum(samples)
+    return {
+        'count': len(samples),
+        'mean_ms': 1000 * total / len(samples) if samples else 0.0,
+        'p50_ms': 1000 * percentile(samples, 0.50),
+        'p95_ms': 1000 * percentile(samples, 0.95),
+        'p99_ms': 1000 * percentile(samples, 0.99)
+    }
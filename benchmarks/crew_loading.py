@@ -0,0 +1,121 @@
+'''
+Benchmark for the crew loading of the actor listing (include=crew)
+    compares the joined eager load the listing used before with the shipped path, column selects through
+    actor_serializer with embed_crew adding the crews in one query per page or batch, and with no crew at all
+    reports the rows the database returns, the statements run and the latency of one page and of the full listing
+
+    python benchmarks/crew_loading.py --actors 100000 --movies 5000 --crews 300000
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import configure_database, seed_database, summarize
+
+configure_database()
+
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload
+
+from app import create_app
+from helpers.streaming import DEFAULT_BATCH_SIZE, format_in_batches, iterate_rows
+from models import db, Actor, Crew, actor_serializer, embed_crew
+
+
+def joined(query, full):
+    actors = []
+    for actor in query.options(joinedload(Actor.crew)).all():
+        record = actor.format()
+        record['crew'] = [crew.format() for crew in actor.crew]
+        actors.append(record)
+    return actors
+
+
+def columns(query, full):
+    return actor_serializer.to_dicts(actor_serializer.select(query).all())
+
+
+def embedded(query, full):
+    select = actor_serializer.select(query, extra=('id',))
+    if full:
+        rows = iterate_rows(select, DEFAULT_BATCH_SIZE)
+        embed = (lambda records, batch: embed_crew(records, batch, Crew.actor_id))
+        return list(format_in_batches(rows, actor_serializer.formatter(), DEFAULT_BATCH_SIZE, embed))
+
+    rows = select.all()
+    return embed_crew(actor_serializer.to_dicts(rows), rows, Crew.actor_id)
+
+
+STRATEGIES = {
+    'joined': joined,
+    'none': columns,
+    'embed': embedded,
+}
+
+
+def count_rows(run):
+    '''
+    Rows returned by the statements a listing runs, the embedded crews add their own statements
+    '''
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        run()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    db.session.expunge_all()
+
+    rows = 0
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for statement, parameters in statements:
+            cursor.execute(statement, parameters)
+            rows += len(cursor.fetchall())
+    finally:
+        connection.close()
+    return rows, len(statements)
+
+
+def measure(run, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - started)
+        db.session.expunge_all()
+    return summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='actor listing with different crew loading strategies')
+    parser.add_argument('--actors', type=int, default=100000)
+    parser.add_argument('--movies', type=int, default=5000)
+    parser.add_argument('--crews', type=int, default=300000)
+    parser.add_argument('--per-page', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        seed_database(args.actors, args.movies, args.crews)
+
+        for label, listing in (('page', lambda: Actor.query.order_by(Actor.name.asc()).limit(args.per_page)),
+                               ('full', lambda: Actor.query)):
+            for strategy, load in STRATEGIES.items():
+                run = (lambda: load(listing(), 'full' == label))
+                rows, statements = count_rows(run)
+                result = measure(run, args.repeat)
+                print('{:<5} {:<9} rows={:<8} statements={} mean={mean_ms:.2f}ms p95={p95_ms:.2f}ms'
+                      .format(label, strategy, rows, statements, **result))
+
+
+if __name__ == '__main__':
+    main()
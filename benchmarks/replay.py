@@ -0,0 +1,168 @@
+'''
+Load replay against create_app()
+    seeds the database, signs a token with a local key and replays the weighted request mix of a json file
+    reports throughput, latency percentiles and SQL statements per request for every entry of the mix
+    --save writes the results as a baseline, --baseline compares against one and exits with 1 on regressions
+
+    python benchmarks/replay.py --actors 10000 --movies 2000 --crews 50000 --requests 5000 --save baseline.json
+    python benchmarks/replay.py --actors 10000 --movies 2000 --crews 50000 --requests 5000 --baseline baseline.json
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import configure_database, configure_local_auth, make_token, seed_database, summarize
+
+PRIVATE_KEY = configure_local_auth()
+configure_database()
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import create_app
+
+statement_counts = threading.local()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def count_statement(connection, cursor, statement, parameters, context, executemany):
+    statement_counts.value = getattr(statement_counts, 'value', 0) + 1
+
+
+def load_mix(path):
+    with open(path) as mix_file:
+        mix = json.load(mix_file)
+    for entry in mix['requests']:
+        entry.setdefault('method', 'GET')
+        entry.setdefault('weight', 1)
+        entry.setdefault('status', 200)
+    return mix
+
+
+def build_schedule(mix, requests, seed):
+    entries = mix['requests']
+    generator = random.Random(seed)
+    return generator.choices(entries, weights=[entry['weight'] for entry in entries], k=requests)
+
+
+def replay(app, schedule, headers, results):
+    client = app.test_client()
+    for entry in schedule:
+        statement_counts.value = 0
+        started = time.perf_counter()
+        response = client.open(entry['path'], method=entry['method'], headers=headers, json=entry.get('body'))
+        response.get_data()
+        elapsed = time.perf_counter() - started
+
+        result = results[entry['name']]
+        result['samples'].append(elapsed)
+        result['statements'].append(statement_counts.value)
+        if response.status_code != entry['status']:
+            result['errors'] += 1
+
+
+def run(app, mix, requests, concurrency, warmup, seed):
+    token = make_token(PRIVATE_KEY, mix.get('permissions', []))
+    headers = {'Authorization': 'Bearer ' + token}
+    schedule = build_schedule(mix, requests, seed)
+
+    warmup_results = dict((entry['name'], {'samples': [], 'statements': [], 'errors': 0}) for entry in mix['requests'])
+    replay(app, mix['requests'] * warmup, headers, warmup_results)
+
+    results = dict((entry['name'], {'samples': [], 'statements': [], 'errors': 0}) for entry in mix['requests'])
+    threads = [threading.Thread(target=replay, args=(app, schedule[index::concurrency], headers, results))
+               for index in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    report = {'requests': requests, 'concurrency': concurrency, 'seconds': elapsed,
+              'throughput': requests / elapsed, 'endpoints': {}}
+    for name, result in results.items():
+        if not result['samples']:
+            continue
+        summary = summarize(result['samples'])
+        summary['errors'] = result['errors']
+        summary['statements'] = sum(result['statements']) / len(result['statements'])
+        summary['throughput'] = len(result['samples']) / sum(result['samples'])
+        report['endpoints'][name] = summary
+    return report
+
+
+def compare(report, baseline, tolerance):
+    '''
+    Lists the endpoints whose p95 latency grew by more than tolerance or that run more SQL statements
+    '''
+    regressions = []
+    for name, current in report['endpoints'].items():
+        previous = baseline['endpoints'].get(name)
+        if previous is None:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append('{}: p95 {:.2f}ms -> {:.2f}ms'.format(name, previous['p95_ms'], current['p95_ms']))
+        if current['statements'] > previous['statements']:
+            regressions.append('{}: {:.1f} -> {:.1f} statements'.format(name, previous['statements'],
+                                                                       current['statements']))
+        if current['errors'] > previous['errors']:
+            regressions.append('{}: {} -> {} errors'.format(name, previous['errors'], current['errors']))
+    return regressions
+
+
+def print_report(report):
+    print('{requests} requests, concurrency {concurrency}: {throughput:.1f} req/s'.format(**report))
+    print('{:<20} {:>6} {:>9} {:>9} {:>9} {:>9} {:>6} {:>6}'.format(
+        'endpoint', 'count', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'sql', 'errors'))
+    for name, result in sorted(report['endpoints'].items()):
+        print('{:<20} {count:>6} {throughput:>9.1f} {p50_ms:>9.2f} {p95_ms:>9.2f} {p99_ms:>9.2f} {statements:>6.1f} '
+              '{errors:>6}'.format(name, **result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replays a request mix against the application')
+    parser.add_argument('--mix', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'request_mix.json'))
+    parser.add_argument('--actors', type=int, default=2000)
+    parser.add_argument('--movies', type=int, default=500)
+    parser.add_argument('--crews', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=2, help='unmeasured passes over every entry of the mix')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='writes the results to this file')
+    parser.add_argument('--baseline', help='compares the results with a file written by --save')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 growth against the baseline')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        seed_database(args.actors, args.movies, args.crews)
+
+    report = run(app, load_mix(args.mix), args.requests, args.concurrency, args.warmup, args.seed)
+    print_report(report)
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['concurrency'] != report['concurrency']:
+            print('WARNING the baseline ran with concurrency {}'.format(baseline['concurrency']))
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+'''
+Benchmark for the actor name search
+    compares the plain ILIKE scan with the search backend for growing table sizes
+    on postgres the backend uses the pg_trgm indexes (run the migrations first), elsewhere the in-memory index
+
+    python benchmarks/search.py --sizes 1000 10000 100000
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import configure_database, seed_database, summarize
+
+configure_database()
+
+from app import create_app
+from models import Actor, actor_search
+
+TERMS = ['00012', '4567', 'or 0999', '123']
+
+
+def measure(run, repeat):
+    samples = []
+    for _ in range(repeat):
+        for term in TERMS:
+            started = time.perf_counter()
+            run(term)
+            samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def ilike(term):
+    return Actor.query.filter(Actor.name.ilike('%' + term + '%')).limit(10).all()
+
+
+def indexed(term):
+    query, relevance = actor_search.filter(Actor.query, term)
+    if relevance is not None:
+        query = query.order_by(relevance)
+    return query.limit(10).all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='actor name search with and without the search backend')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        for size in args.sizes:
+            seed_database(size, 0, 0)
+            actor_search.index.invalidate()
+            indexed(TERMS[0])
+
+            for label, run in (('ilike', ilike), ('indexed', indexed)):
+                result = measure(run, args.repeat)
+                print('{:<8} actors={:<8} mean={mean_ms:.3f}ms p95={p95_ms:.3f}ms'.format(label, size, **result))
+
+
+if __name__ == '__main__':
+    main()
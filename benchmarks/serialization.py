@@ -0,0 +1,64 @@
+'''
+Benchmark for the listing serialization
+    entities: Actor.query + format() + jsonify, the path listings used before
+    columns: actor_serializer.select() + to_dicts() + json_response with the configured JSON_ENCODER
+
+    python benchmarks/serialization.py --rows 10 1000 100000
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import configure_database, seed_database, summarize
+
+configure_database()
+
+from flask import jsonify
+
+from app import create_app
+from models import db, Actor, actor_serializer
+from helpers.serialization import json_response
+
+
+def entities(rows):
+    actors = Actor.query.order_by(Actor.id.asc()).limit(rows).all()
+    return jsonify({'actors': list(map(lambda actor: actor.format(), actors))})
+
+
+def columns(rows):
+    query = actor_serializer.select(Actor.query.order_by(Actor.id.asc()).limit(rows))
+    return json_response({'actors': actor_serializer.to_dicts(query.all())})
+
+
+def measure(run, rows, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run(rows).get_data()
+        samples.append(time.perf_counter() - started)
+        db.session.expunge_all()
+    return summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='actor listing serialization, entities versus columns')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10, 1000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        seed_database(max(args.rows), 0, 0)
+
+        with app.test_request_context('/api/actors'):
+            for rows in args.rows:
+                for label, run in (('entities', entities), ('columns', columns)):
+                    result = measure(run, rows, args.repeat)
+                    print('{:<9} rows={:<7} mean={mean_ms:.2f}ms p95={p95_ms:.2f}ms'.format(label, rows, **result))
+
+
+if __name__ == '__main__':
+    main()
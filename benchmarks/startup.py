@@ -0,0 +1,77 @@
+'''
+Cold start benchmark
+    every run starts a fresh interpreter and times importing app, creating the application (first access of app.app)
+    and the first requests, one without and one with a database query
+    the database is seeded once before the runs
+
+    python benchmarks/startup.py --runs 10
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import configure_database, configure_local_auth, make_token, summarize
+
+PHASES = ('import', 'create_app', 'first_request', 'first_query')
+
+
+def child():
+    started = time.perf_counter()
+    import app as app_module
+    imported = time.perf_counter()
+    app = app_module.app
+    created = time.perf_counter()
+
+    client = app.test_client()
+    client.get('/')
+    first_request = time.perf_counter()
+
+    token = make_token(os.environ['BENCHMARK_PRIVATE_KEY'], ['view:actors'])
+    response = client.get('/api/actors?page=1&perPage=10', headers={'Authorization': 'Bearer ' + token})
+    first_query = time.perf_counter()
+    if 200 != response.status_code:
+        raise RuntimeError('first query failed with ' + str(response.status_code))
+
+    print(json.dumps({
+        'import': imported - started,
+        'create_app': created - imported,
+        'first_request': first_request - created,
+        'first_query': first_query - first_request
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='import, create_app and first request latency of a fresh process')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--actors', type=int, default=1000)
+    args = parser.parse_args()
+
+    os.environ['BENCHMARK_PRIVATE_KEY'] = configure_local_auth()
+    configure_database()
+
+    from app import create_app
+    from benchmarks.common import seed_database
+    with create_app().app_context():
+        seed_database(args.actors, 0, 0)
+
+    samples = dict((phase, []) for phase in PHASES)
+    for _ in range(args.runs):
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child'])
+        timings = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+        for phase in PHASES:
+            samples[phase].append(timings[phase])
+
+    for phase in PHASES:
+        print('{:<14} mean={mean_ms:.1f}ms p50={p50_ms:.1f}ms p95={p95_ms:.1f}ms'.format(phase, **summarize(samples[phase])))
+
+
+if __name__ == '__main__':
+    if '--child' in sys.argv:
+        child()
+    else:
+        main()
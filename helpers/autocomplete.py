@@ -0,0 +1,177 @@
+import threading
+import time
+from bisect import bisect_left, insort
+
+from helpers.replicas import replica_set
+from helpers.versioning import table_versions
+
+'''
+Prefix autocomplete
+    PrefixIndex keeps the lowercased texts of a column in sorted lists and answers prefix lookups with a binary search
+    texts starting with the prefix come first, then texts with a later word starting with it, e.g. "han" finds
+    "Hank Azaria" before "Tom Hanks"
+    AutocompleteBackend builds the index from the database on first use, keeps it current with the write listeners
+    and rebuilds it when the table version moved without it, e.g. after writes of other workers sharing the versions
+    per process versions do not move on other workers' writes, so an index is also rebuilt once it is older than
+    max_age seconds (AUTOCOMPLETE_MAX_AGE, default 300, 0 only rebuilds on version changes)
+'''
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+DEFAULT_MAX_AGE = 300
+
+
+def words(text):
+    return text.lower().split()
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._texts = {}
+        self._names = []
+        self._words = []
+        self._built = False
+        self.version = None
+        self.built_at = None
+        self._lock = threading.RLock()
+
+    @property
+    def built(self):
+        return self._built
+
+    def build(self, rows, version=None):
+        with self._lock:
+            self._texts = {}
+            self._names = []
+            self._words = []
+            for record_id, text in rows:
+                if text is not None:
+                    self._texts[record_id] = text
+                    self._names.append(self._name_key(record_id, text))
+                    self._words += self._word_keys(record_id, text)
+            self._names.sort()
+            self._words.sort()
+            self._built = True
+            self.version = version
+            self.built_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._built = False
+            self._texts = {}
+            self._names = []
+            self._words = []
+            self.version = None
+
+    def add(self, record_id, text):
+        with self._lock:
+            self._remove(record_id)
+            if text is None:
+                return
+            self._texts[record_id] = text
+            insort(self._names, self._name_key(record_id, text))
+            for key in self._word_keys(record_id, text):
+                insort(self._words, key)
+
+    def remove(self, record_id):
+        with self._lock:
+            self._remove(record_id)
+
+    def search(self, prefix, limit=DEFAULT_LIMIT):
+        '''
+        Up to limit (id, text) pairs matching prefix, whole text matches first, each group in alphabetical order
+        '''
+        prefix = ' '.join(words(prefix))
+        if '' == prefix or limit <= 0:
+            return []
+
+        with self._lock:
+            matches = []
+            seen = set()
+            for keys in (self._names, self._words):
+                index = bisect_left(keys, (prefix,))
+                while index < len(keys) and len(matches) < limit and keys[index][0].startswith(prefix):
+                    record_id = keys[index][1]
+                    if record_id not in seen:
+                        seen.add(record_id)
+                        matches.append((record_id, self._texts[record_id]))
+                    index += 1
+            return matches
+
+    def _name_key(self, record_id, text):
+        return ' '.join(words(text)), record_id
+
+    def _word_keys(self, record_id, text):
+        parts = words(text)
+        # Every suffix starting at a later word, so multi word prefixes match too
+        return [(' '.join(parts[start:]), record_id) for start in range(1, len(parts))]
+
+    def _remove(self, record_id):
+        text = self._texts.pop(record_id, None)
+        if text is None:
+            return
+        self._discard(self._names, self._name_key(record_id, text))
+        for key in self._word_keys(record_id, text):
+            self._discard(self._words, key)
+
+    def _discard(self, keys, key):
+        index = bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            del keys[index]
+
+
+class AutocompleteBackend:
+    def __init__(self, model, column_name, max_age=DEFAULT_MAX_AGE):
+        self.model = model
+        self.column_name = column_name
+        self.max_age = max_age
+        self.index = PrefixIndex()
+        self._build_lock = threading.Lock()
+
+    @property
+    def table(self):
+        return self.model.__tablename__
+
+    def is_current(self, version):
+        if not self.index.built or self.index.version != version:
+            return False
+        return not self.max_age or time.monotonic() - self.index.built_at < self.max_age
+
+    def ensure_built(self):
+        version = table_versions.get(self.table)
+        if self.is_current(version):
+            return
+        with self._build_lock:
+            if self.is_current(version):
+                return
+            column = getattr(self.model, self.column_name)
+            rows = self.model.query.session.query(self.model.id, column).all()
+            # Rows read from a lagging replica are used once and rebuilt on the next lookup
+            self.index.build(rows, None if replica_set.may_be_stale() else version)
+
+    def suggest(self, prefix, limit=DEFAULT_LIMIT):
+        self.ensure_built()
+        return self.index.search(prefix, limit)
+
+    def on_write(self, model, action, records):
+        if model is not self.model or not self.index.built:
+            return
+
+        # The write listeners run after the version was bumped for this write, any other step means
+        # writes the index has not seen, e.g. of other workers sharing the versions
+        version = table_versions.get(self.table)
+        if self.index.version is None or version != self.index.version + 1:
+            self.index.invalidate()
+            return
+
+        for record in records or [None]:
+            record_id = getattr(record, 'id', None)
+            if record_id is None:
+                # Rows written without their primary key, rebuild on the next lookup
+                self.index.invalidate()
+                return
+            if 'delete' == action:
+                self.index.remove(record_id)
+            else:
+                self.index.add(record_id, getattr(record, self.column_name))
+        self.index.version = version
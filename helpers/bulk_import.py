@@ -0,0 +1,82 @@
+import json
+import sys
+
+'''
+NDJSON bulk import
+    reads one json record per line from a stream, so memory is bounded by the chunk size
+    valid records are written through the model's unit of work, one commit per chunk
+    invalid lines (and chunks the database rejects) are reported without aborting the import
+'''
+
+DEFAULT_CHUNK_SIZE = 500
+MAX_CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+
+
+def get_chunk_size(value, default=DEFAULT_CHUNK_SIZE):
+    if value is None or '' == value:
+        return default
+    return max(1, min(int(value), MAX_CHUNK_SIZE))
+
+
+class ImportReport:
+    def __init__(self, max_errors=MAX_REPORTED_ERRORS):
+        self.max_errors = max_errors
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line, message, count=1):
+        self.failed += count
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'error': message})
+
+    def format(self):
+        return {
+            'success': True,
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errorsTruncated': self.failed > len(self.errors)
+        }
+
+
+def import_ndjson(lines, model, validate, chunk_size=DEFAULT_CHUNK_SIZE):
+    report = ImportReport()
+    chunk = []
+    first_line = None
+
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            fields = validate(json.loads(line))
+        except ValueError as e:
+            report.add_error(line_number, getattr(e, 'message', 'Invalid JSON provided'))
+            continue
+
+        if not chunk:
+            first_line = line_number
+        chunk.append(model(**fields))
+
+        if len(chunk) >= chunk_size:
+            _write_chunk(model, chunk, first_line, report)
+            chunk = []
+
+    if chunk:
+        _write_chunk(model, chunk, first_line, report)
+
+    return report
+
+
+def _write_chunk(model, chunk, first_line, report):
+    try:
+        with model.batch() as batch:
+            for record in chunk:
+                batch.add(record)
+        report.imported += len(chunk)
+    except Exception:
+        print(sys.exc_info())
+        report.add_error(first_line, 'Unable to save the chunk starting at this line', len(chunk))
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, make_response, request
+
+from helpers.replicas import replica_set
+from helpers.versioning import table_versions
+
+'''
+Response cache for read endpoints
+    entries are keyed by route, normalized query arguments and the versions of the tables the route reads
+    a write through RepositoryMixin bumps the table version, so older entries are simply never looked up again
+    backends: MemoryCacheBackend (per process, LRU) or RedisCacheBackend (shared by all workers)
+'''
+
+DEFAULT_TTL = 300
+MAX_CACHED_BODY = 1024 * 1024
+
+
+class MemoryCacheBackend:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def incr(self, key):
+        with self._lock:
+            expires_at, value = self._entries.get(key, (None, 0))
+            value = int(value) + 1
+            self._entries[key] = (expires_at, value)
+            return value
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisCacheBackend:
+    '''
+    Works with any client exposing redis-py's get/set(ex=)/incr/delete
+    '''
+
+    def __init__(self, client, prefix='fsnd:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value, ex=ttl)
+
+    def incr(self, key):
+        return int(self.client.incr(self.prefix + key))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+def create_backend(name, url=None, max_entries=1024):
+    if name is None or '' == name or 'off' == name:
+        return None
+    if 'memory' == name:
+        return MemoryCacheBackend(max_entries)
+    if 'redis' == name:
+        # redis is only needed when this backend is configured
+        import redis
+        return RedisCacheBackend(redis.Redis.from_url(url))
+    raise ValueError('Unknown cache backend ' + name)
+
+
+def request_signature(tables):
+    '''
+    Route, sorted query arguments and table versions of the current request
+    '''
+    arguments = sorted(request.args.items(multi=True))
+    versions = [table_versions.epoch, table_versions.snapshot(tables)]
+    return json.dumps([request.path, arguments, versions], separators=(',', ':'))
+
+
+def pack_response(response):
+    header = json.dumps({'status': response.status_code, 'mimetype': response.mimetype}).encode('utf-8')
+    return header + b'\n' + response.get_data()
+
+
+def unpack_response(value):
+    header, body = value.split(b'\n', 1)
+    meta = json.loads(header.decode('utf-8'))
+    return Response(body, status=meta['status'], mimetype=meta['mimetype'])
+
+
+class ResponseCache:
+    def __init__(self, backend=None, ttl=DEFAULT_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, backend, ttl=DEFAULT_TTL):
+        self.backend = backend
+        self.ttl = ttl
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def key_for(self, tables):
+        return 'response:' + hashlib.sha1(request_signature(tables).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return unpack_response(value)
+
+    def put(self, key, response):
+        if 200 != response.status_code or response.is_streamed:
+            return
+        if response.calculate_content_length() > MAX_CACHED_BODY:
+            return
+        self.backend.set(key, pack_response(response), self.ttl)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+response_cache = ResponseCache()
+
+
+'''
+@cached_response(*tables) decorator method
+    place it below requires_auth so permissions are checked before a cached response is served
+    tables: names of the tables the endpoint reads, their versions are part of the cache key
+'''
+
+
+def cached_response(*tables):
+    def cached_response_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not response_cache.enabled:
+                return f(*args, **kwargs)
+
+            key = response_cache.key_for(tables)
+            cached = response_cache.get(key)
+            if cached is not None:
+                return cached
+
+            response = make_response(f(*args, **kwargs))
+            if not replica_set.may_be_stale():
+                response_cache.put(key, response)
+            return response
+
+        return wrapper
+
+    return cached_response_decorator
+
+
+'''
+setup_cache(app)
+    RESPONSE_CACHE: off (default), memory or redis
+    RESPONSE_CACHE_TTL: seconds an entry is kept at most
+    RESPONSE_CACHE_SIZE: entries kept by the memory backend
+    REDIS_URL: used by the redis backend, which also shares the table versions and the replica sticky window
+    between workers
+'''
+
+
+def setup_cache(app):
+    backend = create_backend(os.environ.get('RESPONSE_CACHE'), os.environ.get('REDIS_URL'),
+                             int(os.environ.get('RESPONSE_CACHE_SIZE', 1024)))
+    response_cache.configure(backend, int(os.environ.get('RESPONSE_CACHE_TTL', DEFAULT_TTL)))
+    if isinstance(backend, RedisCacheBackend):
+        table_versions.use_store(backend)
+        replica_set.use_store(backend)
+    app.extensions['response_cache'] = response_cache
@@ -0,0 +1,125 @@
+import os
+import threading
+from functools import wraps
+
+from flask import abort, make_response, request
+from werkzeug.exceptions import HTTPException, default_exceptions
+
+from helpers.cache import pack_response, request_signature, unpack_response
+from helpers.metrics import registry
+
+'''
+Single flight request coalescing
+    concurrent identical reads in a process run the endpoint once, the others wait and get a copy of its response
+    requests are identical when route, query arguments and the versions of the tables they read match,
+    so a write in between starts a new flight
+    threading primitives are used, gevent's monkey patching turns them into cooperative ones
+    REQUEST_COALESCING=false turns it off, COALESCING_TIMEOUT is the number of seconds a follower waits
+    before running the endpoint itself (default 30)
+    streamed responses are not shared, followers of a streamed flight run the endpoint themselves
+    when the endpoint raises, e.g. on a database timeout, its followers fail too instead of all retrying it at once:
+    an HTTP error is raised again as a new exception with the same code and description, any other error as a
+    CoalescedError caused by it
+'''
+
+DEFAULT_TIMEOUT = 30
+
+registry.counter('coalesced_requests_total', 'Requests answered with the response of an identical concurrent request')
+
+
+class CoalescedError(Exception):
+    pass
+
+
+def raise_shared_error(error):
+    '''
+    Raises a new exception per follower, concurrent raises of one instance would tangle its traceback
+    '''
+    if isinstance(error, HTTPException) and error.code in default_exceptions:
+        abort(error.code, description=error.description)
+    raise CoalescedError('An identical concurrent request failed: ' + repr(error)) from error
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, enabled=True, timeout=DEFAULT_TIMEOUT):
+        self.enabled = enabled
+        self.timeout = timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, call):
+        '''
+        Returns (result, shared): call() once per key at a time, concurrent callers of the same key share its result
+        an exception of call() makes every caller sharing it fail, see raise_shared_error
+        a result of None or a timeout make a follower run call() itself
+        '''
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+
+        if not leader:
+            if flight.done.wait(self.timeout):
+                if flight.error is not None:
+                    raise_shared_error(flight.error)
+                if flight.result is not None:
+                    return flight.result, True
+            return call(), False
+
+        try:
+            flight.result = call()
+            return flight.result, False
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+single_flight = SingleFlight('false' != os.environ.get('REQUEST_COALESCING', 'true'),
+                             float(os.environ.get('COALESCING_TIMEOUT', DEFAULT_TIMEOUT)))
+
+
+'''
+@coalesced(*tables) decorator method
+    tables: the tables the endpoint reads, as for cached_response
+    place it below cached_response so only cache misses are coalesced
+'''
+
+
+def coalesced(*tables):
+    def coalesced_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not single_flight.enabled:
+                return f(*args, **kwargs)
+
+            own_response = []
+
+            def call():
+                response = make_response(f(*args, **kwargs))
+                own_response.append(response)
+                if response.is_streamed:
+                    return None
+                return pack_response(response)
+
+            packed, shared = single_flight.run(request_signature(tables), call)
+            if not shared:
+                return own_response[0]
+
+            registry.inc('coalesced_requests_total', (('route', request.url_rule.rule),))
+            return unpack_response(packed)
+
+        return wrapper
+
+    return coalesced_decorator
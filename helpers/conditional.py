@@ -0,0 +1,47 @@
+import hashlib
+from functools import wraps
+
+from flask import make_response, request
+
+from helpers.cache import request_signature
+from helpers.replicas import replica_set
+from helpers.versioning import table_versions
+
+'''
+@conditional_get(*tables) decorator method
+    the etag of a read is derived from the route, its query arguments and the versions of the tables it reads
+    a request whose If-None-Match carries the current etag gets 304 Not Modified
+    without running the endpoint, so no query and no serialization
+    etags are only sent while the table versions are shared (redis cache backend): with per process versions
+    a worker that did not see a write would keep answering 304 for the old etag
+    place it below requires_auth and above cached_response
+'''
+
+
+def compute_etag(tables):
+    return hashlib.sha1(request_signature(tables).encode('utf-8')).hexdigest()
+
+
+def conditional_get(*tables):
+    def conditional_get_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not table_versions.shared:
+                return f(*args, **kwargs)
+
+            etag = compute_etag(tables)
+            if etag in request.if_none_match:
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if 200 != response.status_code or replica_set.may_be_stale():
+                    return response
+
+            response.set_etag(etag)
+            if 'Cache-Control' not in response.headers:
+                response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+
+        return wrapper
+
+    return conditional_get_decorator
@@ -0,0 +1,70 @@
+import copy
+import threading
+import time
+
+from helpers.replicas import replica_set
+
+'''
+ModelCounters
+    in-process snapshot of row counts kept current by model writes instead of COUNT(*) per request
+    the snapshot is loaded lazily and reconciled against the database every reconcile_interval seconds,
+    which also picks up writes made by other worker processes
+    writes whose effect cannot be counted (updates of counted columns, unknown rows) force a reconcile
+    counts read from a lagging replica are returned once and reloaded on the next snapshot
+'''
+
+
+class ModelCounters:
+    def __init__(self, load, keys, reconcile_interval=300):
+        '''
+        load: returns {'<key>': count, ..., 'genders': {'<name>': count}} straight from the database
+        keys: maps table names to the counter key of the snapshot
+        '''
+        self.load = load
+        self.keys = keys
+        self.reconcile_interval = reconcile_interval
+        self._snapshot = None
+        self._loaded_at = None
+        self._stale = False
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        with self._lock:
+            if self._needs_reconcile():
+                self._snapshot = self.load()
+                self._loaded_at = time.monotonic()
+                self._stale = replica_set.may_be_stale()
+            return copy.deepcopy(self._snapshot)
+
+    def invalidate(self):
+        with self._lock:
+            self._stale = True
+
+    def on_write(self, model, action, records):
+        key = self.keys.get(model.__tablename__)
+        if key is None:
+            return
+
+        with self._lock:
+            if self._snapshot is None or self._stale:
+                return
+            if records is None or 'update' == action:
+                self._stale = True
+                return
+
+            step = 1 if 'insert' == action else -1
+            self._snapshot[key] += step * len(records)
+            if 'genders' in self._snapshot and 'actors' == key:
+                for record in records:
+                    try:
+                        gender = record.gender
+                    except Exception:
+                        self._stale = True
+                        return
+                    if gender is not None:
+                        self._snapshot['genders'][gender.name] += step
+
+    def _needs_reconcile(self):
+        if self._snapshot is None or self._stale:
+            return True
+        return time.monotonic() - self._loaded_at >= self.reconcile_interval
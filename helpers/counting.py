@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import abort
+from sqlalchemy import func
+
+from helpers.replicas import replica_set
+from helpers.versioning import table_versions
+
+COUNT_MODES = ('exact', 'estimate')
+DEFAULT_TTL = 300
+
+'''
+CountCache
+    exact totals of filtered listings keyed by table and filter signature
+    an entry is reused while the table version it was counted at is still current and for at most ttl seconds,
+    without a shared version store other workers' writes do not move this worker's versions,
+    so the ttl bounds how long their totals can be off (COUNT_CACHE_TTL, default 300, 0 keeps entries until a write)
+'''
+
+
+class CountCache:
+    def __init__(self, max_size=256, ttl=DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            if entry[2] is not None and entry[2] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, count):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (version, count, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+count_cache = CountCache(ttl=float(os.environ.get('COUNT_CACHE_TTL', DEFAULT_TTL)))
+
+
+def get_count_mode(value):
+    if value is None or '' == value:
+        return 'exact'
+    if value not in COUNT_MODES:
+        abort(422)
+    return value
+
+
+def exact_count(query, model):
+    return query.with_entities(func.count(model.id)).order_by(None).scalar()
+
+
+def estimated_count(query, model):
+    '''
+    Row estimate of the postgres planner, None when the backend cannot provide one
+    '''
+    session = query.session
+    bind = session.get_bind()
+    if 'postgresql' != bind.dialect.name:
+        return None
+
+    compiled = query.with_entities(model.id).order_by(None).statement.compile(dialect=bind.dialect)
+    plan = session.connection().execute('EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+'''
+count_total(query, model, signature, mode)
+    signature: hashable description of the filters applied to the query
+    mode: 'exact' uses the cached exact count, 'estimate' asks the planner and falls back to exact
+    returns the total and the mode that produced it
+'''
+
+
+def count_total(query, model, signature, mode='exact'):
+    if 'estimate' == mode:
+        estimate = estimated_count(query, model)
+        if estimate is not None:
+            return estimate, 'estimate'
+
+    table = model.__tablename__
+    key = (table, signature)
+    version = table_versions.get(table)
+    count = count_cache.get(key, version)
+    if count is None:
+        count = exact_count(query, model)
+        if not replica_set.may_be_stale():
+            count_cache.put(key, version, count)
+    return count, 'exact'
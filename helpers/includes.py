@@ -0,0 +1,37 @@
+from flask import request, abort
+
+
+def get_includes(allowed):
+    '''
+    Parses the comma separated include argument, e.g. include=crew
+    aborts with 422 on relations the endpoint cannot embed
+    '''
+    value = request.args.get('include')
+    if value is None or '' == value:
+        return set()
+
+    includes = set(part.strip() for part in value.split(',') if '' != part.strip())
+    if not includes.issubset(allowed):
+        abort(422)
+    return includes
+
+
+def get_fields(allowed):
+    '''
+    Parses the comma separated fields argument, e.g. fields=id,name
+    returns the requested keys in order, None when the argument is absent
+    aborts with 422 on keys that are not in allowed
+    '''
+    value = request.args.get('fields')
+    if value is None or '' == value:
+        return None
+
+    fields = []
+    for part in value.split(','):
+        part = part.strip()
+        if '' == part or part in fields:
+            continue
+        if part not in allowed:
+            abort(422)
+        fields.append(part)
+    return tuple(fields) or None
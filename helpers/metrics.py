@@ -0,0 +1,246 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+
+from flask import g, request
+from sqlalchemy.pool import QueuePool
+
+'''
+Metrics
+    counters and histograms kept in memory per process and exposed in the Prometheus text format at /metrics
+    METRICS_DIR makes the numbers safe under several gunicorn workers: every worker writes its snapshot to
+    METRICS_DIR/metrics_<pid>.json at most every METRICS_FLUSH_INTERVAL seconds and /metrics adds up all snapshots
+    the directory should be emptied before the server starts, like prometheus_client's multiprocess directory
+    snapshots of exited workers keep adding to the counters and histograms, their gauges are left out
+'''
+
+DEFAULT_FLUSH_INTERVAL = 5
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+POOL_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self._values = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self.enabled = False
+        self.directory = None
+        self.flush_interval = DEFAULT_FLUSH_INTERVAL
+        self._flushed_at = 0
+
+    def counter(self, name, description):
+        self.metrics[name] = ('counter', description, None)
+
+    def gauge(self, name, description):
+        self.metrics[name] = ('gauge', description, None)
+
+    def histogram(self, name, description, buckets):
+        self.metrics[name] = ('histogram', description, tuple(buckets))
+
+    def add_collector(self, collector):
+        '''
+        collector() returns {(name, labels): value} for counters or gauges read when a snapshot is taken
+        gauges are added up over the processes like counters
+        '''
+        self._collectors.append(collector)
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = self.metrics[name][2]
+        key = (name, labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(buckets), 0.0, 0]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+        self._flushed_at = 0
+
+    def snapshot(self):
+        with self._lock:
+            values = [[name, list(labels), [list(value[0]), value[1], value[2]] if isinstance(value, list) else value]
+                      for (name, labels), value in self._values.items()]
+        for collector in self._collectors:
+            values += [[name, list(labels), value] for (name, labels), value in collector().items()]
+        return values
+
+    def configure(self, directory, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.enabled = True
+        self.directory = directory
+        self.flush_interval = flush_interval
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def flush(self):
+        if not self.directory:
+            return
+        self._flushed_at = time.monotonic()
+        path = os.path.join(self.directory, 'metrics_%d.json' % os.getpid())
+        with open(path + '.tmp', 'w') as snapshot_file:
+            json.dump(self.snapshot(), snapshot_file)
+        os.replace(path + '.tmp', path)
+
+    def maybe_flush(self, force=False):
+        if self.directory and (force or time.monotonic() - self._flushed_at >= self.flush_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                print('Unable to write metrics: ' + str(e))
+
+    def collect(self):
+        '''
+        Adds up the snapshots of every process, or returns this process' values without METRICS_DIR
+        '''
+        if not self.directory:
+            return self._merge([self.snapshot()])
+
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+            try:
+                with open(path) as snapshot_file:
+                    snapshot = json.load(snapshot_file)
+            except (OSError, ValueError):
+                continue
+            if not is_alive(path):
+                snapshot = [entry for entry in snapshot if 'gauge' != self.metrics.get(entry[0], ('counter',))[0]]
+            snapshots.append(snapshot)
+        return self._merge(snapshots)
+
+    def _merge(self, snapshots):
+        merged = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot:
+                key = (name, tuple(tuple(label) for label in labels))
+                if not isinstance(value, list):
+                    merged[key] = merged.get(key, 0) + value
+                    continue
+                entry = merged.setdefault(key, [[0] * len(value[0]), 0.0, 0])
+                entry[0] = [total + count for total, count in zip(entry[0], value[0])]
+                entry[1] += value[1]
+                entry[2] += value[2]
+        return merged
+
+    def exposition(self):
+        merged = self.collect()
+        lines = []
+        for name in sorted(self.metrics):
+            kind, description, buckets = self.metrics[name]
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for (metric_name, labels), value in sorted(merged.items()):
+                if metric_name != name:
+                    continue
+                if 'histogram' != kind:
+                    lines.append('%s%s %s' % (name, format_labels(labels), value))
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, value[0]):
+                    cumulative += count
+                    lines.append('%s_bucket%s %d' % (name, format_labels(labels + (('le', bound),)), cumulative))
+                lines.append('%s_bucket%s %d' % (name, format_labels(labels + (('le', '+Inf'),)), value[2]))
+                lines.append('%s_sum%s %s' % (name, format_labels(labels), value[1]))
+                lines.append('%s_count%s %d' % (name, format_labels(labels), value[2]))
+        return '\n'.join(lines) + '\n'
+
+
+def is_alive(path):
+    '''
+    Whether the worker that wrote the snapshot at path is still running
+    '''
+    try:
+        pid = int(os.path.basename(path)[len('metrics_'):-len('.json')])
+    except ValueError:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # The process exists but belongs to another user
+        return True
+    return True
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = [(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for key, value in labels]
+    return '{' + ','.join('%s="%s"' % label for label in escaped) + '}'
+
+
+registry = MetricsRegistry()
+registry.counter('http_requests_total', 'Requests by route, method and status')
+registry.histogram('http_request_duration_seconds', 'Request latency by route, method and status', LATENCY_BUCKETS)
+registry.histogram('http_response_size_bytes', 'Response body size by route', SIZE_BUCKETS)
+registry.histogram('db_pool_checkout_seconds', 'Time spent waiting for a database connection', POOL_BUCKETS)
+registry.counter('auth_token_cache_hits_total', 'Tokens served from the verified token cache')
+registry.counter('auth_token_cache_misses_total', 'Tokens that had to be verified')
+
+if hasattr(os, 'register_at_fork'):
+    # A forked worker starts counting from zero, its parent's numbers stay in the parent's snapshot
+    os.register_at_fork(after_in_child=registry.reset)
+atexit.register(registry.maybe_flush, True)
+
+'''
+TimedQueuePool
+    QueuePool recording the time spent waiting for a connection in db_pool_checkout_seconds
+'''
+
+
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            registry.observe('db_pool_checkout_seconds', (), time.perf_counter() - started_at)
+
+
+def setup_metrics(app):
+    '''
+    Records the metrics of every request, METRICS_ENABLED=false turns them off
+    '''
+    if 'false' == os.environ.get('METRICS_ENABLED', 'true'):
+        return
+    registry.configure(os.environ.get('METRICS_DIR'),
+                       float(os.environ.get('METRICS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)))
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started_at = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started_at = g.get('metrics_started_at')
+        if started_at is None:
+            return response
+
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        labels = (('method', request.method), ('route', route), ('status', str(response.status_code)))
+        registry.inc('http_requests_total', labels)
+        registry.observe('http_request_duration_seconds', labels, time.perf_counter() - started_at)
+        size = None if response.is_streamed else response.calculate_content_length()
+        if size is not None:
+            registry.observe('http_response_size_bytes', (('route', route),), size)
+        registry.maybe_flush()
+        return response
@@ -1,6 +1,11 @@
+import base64
+import enum
+import json
 from functools import wraps
 
 from flask import request, abort
+from sqlalchemy import and_, or_
+from sqlalchemy.orm.attributes import InstrumentedAttribute
 
 
 def extract_pagination_params():
@@ -25,6 +30,25 @@ def get_per_page(current, default):
     return current
 
 
+'''
+fetch_page(query, page, per_page)
+    LIMIT/OFFSET page of a query without the COUNT(*) flask-sqlalchemy's paginate always runs
+    aborts with 404 for the same out of range pages paginate does
+'''
+
+
+def fetch_page(query, page, per_page):
+    if page < 1 or per_page < 0:
+        abort(404)
+
+    items = query.limit(per_page).offset((page - 1) * per_page).all()
+
+    if not items and page != 1:
+        abort(404)
+
+    return items
+
+
 def paginated_request(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -36,6 +60,97 @@ def paginated_request(f):
             pagination_info['sort_order'] = request.args.get('sortOrder')
         if request.args.get('getAll') is not None:
             pagination_info['get_all'] = request.args.get('getAll')
+        if request.args.get('cursor') is not None:
+            pagination_info['cursor'] = request.args.get('cursor')
         return f(pagination_info, *args, **kwargs)
 
     return decorated_function
+
+
+'''
+Keyset (cursor) pagination
+    pages are fetched by seeking past the (sort_field, id) of the last row of the previous page
+    so every page costs the same regardless of how deep the client has scrolled
+    cursors are opaque to clients, an empty cursor requests the first page
+'''
+
+
+def encode_cursor(sort_field, sort_order, value, record_id):
+    if isinstance(value, enum.Enum):
+        value = value.name
+    raw = json.dumps({'f': sort_field, 'o': sort_order, 'v': value, 'id': record_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort_field, sort_order):
+    if cursor is None or '' == cursor:
+        return None
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        position = json.loads(raw.decode('utf-8'))
+        value, record_id = position['v'], int(position['id'])
+    except (ValueError, KeyError, TypeError):
+        abort(422)
+
+    if position.get('f') != sort_field or position.get('o') != sort_order:
+        # A cursor only makes sense for the ordering it was issued for
+        abort(422)
+
+    return value, record_id
+
+
+def get_sort_column(model, sort_field):
+    column = getattr(model, sort_field, None)
+    if not isinstance(column, InstrumentedAttribute) or not hasattr(column.property, 'columns'):
+        abort(422)
+    return column
+
+
+def keyset_paginate(query, model, sort_field, sort_order, cursor, per_page):
+    if sort_order not in ('asc', 'desc'):
+        abort(422)
+
+    column = get_sort_column(model, sort_field)
+    position = decode_cursor(cursor, sort_field, sort_order)
+    id_column = model.id
+    ascending = 'asc' == sort_order
+
+    if 'id' == sort_field:
+        ordering = [id_column.asc() if ascending else id_column.desc()]
+        if position is not None:
+            last_id = position[1]
+            query = query.filter(id_column > last_id if ascending else id_column < last_id)
+    else:
+        # NULL sort values are always placed last so the seek condition is the same on every backend
+        ordering = [(column.asc() if ascending else column.desc()).nullslast(),
+                    id_column.asc() if ascending else id_column.desc()]
+        if position is not None:
+            value, last_id = position
+            after_id = id_column > last_id if ascending else id_column < last_id
+            if value is None:
+                query = query.filter(and_(column.is_(None), after_id))
+            else:
+                value = _column_value(column, value)
+                after_value = column > value if ascending else column < value
+                query = query.filter(or_(after_value, and_(column == value, after_id), column.is_(None)))
+
+    items = query.order_by(None).order_by(*ordering).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        last = items[-1]
+        next_cursor = encode_cursor(sort_field, sort_order, getattr(last, sort_field), last.id)
+
+    return items, next_cursor
+
+
+def _column_value(column, value):
+    enum_class = getattr(column.property.columns[0].type, 'enum_class', None)
+    if enum_class is not None:
+        try:
+            return enum_class[value]
+        except KeyError:
+            abort(422)
+    return value
@@ -0,0 +1,110 @@
+import os
+import weakref
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+from helpers.metrics import TimedQueuePool, registry
+
+'''
+Connection pool settings
+    read from the application config first, then from the environment
+    DB_POOL_SIZE, DB_MAX_OVERFLOW: connections kept open and extra connections allowed under load (default 5 and 10)
+    DB_POOL_TIMEOUT: seconds a request waits for a connection before failing (default 30)
+    DB_POOL_RECYCLE: seconds after which a connection is replaced, -1 keeps them (default 1800)
+    DB_POOL_PRE_PING: false skips the liveness check done when a connection is checked out (default true)
+    DB_STATEMENT_TIMEOUT_MS: Postgres statement_timeout of every connection, 0 for none (default 0)
+    sqlite keeps the pools flask-sqlalchemy picks for it
+    the wait for a connection is recorded in db_pool_checkout_seconds and the connections by state in
+    db_pool_connections, both at /metrics
+'''
+
+
+def get_setting(config, name, default):
+    value = config.get(name)
+    if value is None:
+        value = os.environ.get(name, default)
+    return value
+
+
+def pool_options(database_path, config):
+    if database_path.startswith('sqlite'):
+        return {}
+
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': int(get_setting(config, 'DB_POOL_SIZE', 5)),
+        'max_overflow': int(get_setting(config, 'DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(get_setting(config, 'DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(get_setting(config, 'DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': 'false' != str(get_setting(config, 'DB_POOL_PRE_PING', 'true')).lower()
+    }
+
+    statement_timeout = int(get_setting(config, 'DB_STATEMENT_TIMEOUT_MS', 0))
+    if statement_timeout > 0 and database_path.startswith('postgres'):
+        options['connect_args'] = {'options': '-c statement_timeout=%d' % statement_timeout}
+    return options
+
+
+'''
+Fork safety
+    gunicorn forks its workers after app.py may have opened connections in the master
+    a child must neither use nor close the connections it inherited: closing them would end the parent's sessions
+    after a fork every engine gets a fresh pool and the inherited connections are kept referenced so they are never
+    garbage collected (and closed) in the child
+    a connection checked out in a process other than the one that opened it is discarded the same way
+'''
+
+engines = weakref.WeakSet()
+inherited = []
+
+
+def record_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+def check_pid(dbapi_connection, connection_record, connection_proxy):
+    pid = os.getpid()
+    if connection_record.info.get('pid', pid) != pid:
+        inherited.append(dbapi_connection)
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError('Connection record belongs to pid %s, attempting to check out in pid %s'
+                                     % (connection_record.info['pid'], pid))
+
+
+def make_fork_safe(engine):
+    event.listen(engine, 'connect', record_pid)
+    event.listen(engine, 'checkout', check_pid)
+    engines.add(engine)
+    return engine
+
+
+def recreate_pools():
+    for engine in list(engines):
+        inherited.append(engine.pool)
+        engine.pool = engine.pool.recreate()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=recreate_pools)
+
+
+def pool_stats():
+    '''
+    Connections of every engine of this process by state, summed over the engines
+    '''
+    stats = {'size': 0, 'checked_in': 0, 'checked_out': 0, 'overflow': 0}
+    for engine in list(engines):
+        pool = engine.pool
+        if not isinstance(pool, QueuePool):
+            continue
+        stats['size'] += pool.size()
+        stats['checked_in'] += pool.checkedin()
+        stats['checked_out'] += pool.checkedout()
+        stats['overflow'] += max(pool.overflow(), 0)
+    return stats
+
+
+registry.gauge('db_pool_connections', 'Pooled database connections by state, summed over the workers')
+registry.add_collector(lambda: dict((('db_pool_connections', (('state', state),)), value)
+                                    for state, value in pool_stats().items()))
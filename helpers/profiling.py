@@ -0,0 +1,138 @@
+import os
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+'''
+Request profiling
+    opt-in with PROFILE_REQUESTS=true
+    every request records the time spent in the auth, query and serialize phases and the number of SQL statements
+    and reports them in a Server-Timing header, e.g.
+        Server-Timing: auth;dur=0.4, query;dur=3.1;desc="4 statements", serialize;dur=0.9, app;dur=5.2
+    query is the time spent executing SQL, it is not counted in the other phases
+    statements slower than SLOW_QUERY_MS are logged with their plan unless SLOW_QUERY_EXPLAIN=false
+    streamed responses are serialized after the headers are sent, their serialize phase is not reported
+'''
+
+DEFAULT_SLOW_QUERY_MS = 200
+
+settings = {'enabled': False, 'slow_query_ms': DEFAULT_SLOW_QUERY_MS, 'explain': True}
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases = {}
+        self.statements = 0
+        self.sql_time = 0.0
+
+    def add_phase(self, name, duration):
+        self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def add_statement(self, duration):
+        self.statements += 1
+        self.sql_time += duration
+
+    def server_timing(self):
+        timings = []
+        for name in ('auth', 'query', 'serialize'):
+            if 'query' == name:
+                timings.append('query;dur=%.1f;desc="%d statements"' % (self.sql_time * 1000, self.statements))
+            elif name in self.phases:
+                timings.append('%s;dur=%.1f' % (name, self.phases[name] * 1000))
+        timings.append('app;dur=%.1f' % ((time.perf_counter() - self.started_at) * 1000))
+        return ', '.join(timings)
+
+
+def current_profile():
+    if not settings['enabled'] or not has_request_context():
+        return None
+    return g.get('profile')
+
+
+@contextmanager
+def profile_phase(name):
+    '''
+    Times the enclosed block as phase name of the current request, SQL executed inside is left to the query phase
+    does nothing when profiling is off
+    '''
+    profile = current_profile()
+    if profile is None:
+        yield
+        return
+
+    started_at = time.perf_counter()
+    sql_time = profile.sql_time
+    try:
+        yield
+    finally:
+        profile.add_phase(name, time.perf_counter() - started_at - (profile.sql_time - sql_time))
+
+
+def explain(connection, statement, parameters):
+    dialect = connection.dialect.name
+    if 'postgresql' == dialect:
+        prefix = 'EXPLAIN '
+    elif 'sqlite' == dialect:
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        return None
+
+    # The DBAPI cursor bypasses the engine events so the plan is not profiled itself
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return '\n'.join(' '.join(str(value) for value in row) for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault('query_started_at', []).append(time.perf_counter())
+
+
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    started = connection.info.get('query_started_at')
+    if not started:
+        return
+    duration = time.perf_counter() - started.pop()
+
+    profile = current_profile()
+    if profile is not None:
+        profile.add_statement(duration)
+
+    if duration * 1000 < settings['slow_query_ms']:
+        return
+
+    print('Slow query (%.1f ms): %s %r' % (duration * 1000, statement, parameters))
+    if settings['explain'] and not executemany and statement.lstrip().upper().startswith('SELECT'):
+        try:
+            print(explain(connection, statement, parameters))
+        except Exception as e:
+            print('Unable to explain slow query: ' + str(e))
+
+
+def setup_profiling(app):
+    settings['enabled'] = 'true' == os.environ.get('PROFILE_REQUESTS', 'false')
+    settings['slow_query_ms'] = float(os.environ.get('SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS))
+    settings['explain'] = 'false' != os.environ.get('SLOW_QUERY_EXPLAIN', 'true')
+    if not settings['enabled']:
+        return
+
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+    @app.before_request
+    def start_profile():
+        g.profile = RequestProfile()
+
+    @app.after_request
+    def add_server_timing(response):
+        profile = current_profile()
+        if profile is not None:
+            response.headers.add('Server-Timing', profile.server_timing())
+        return response
@@ -0,0 +1,160 @@
+import hashlib
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, has_request_context, request
+from sqlalchemy import create_engine, event
+
+'''
+Read replicas
+    DATABASE_REPLICA_URLS: comma separated replica urls, GET and HEAD requests read from them in round robin
+    REPLICA_HEALTH_CHECK_INTERVAL: seconds a replica's health is trusted before it is checked again (default 10)
+    REPLICA_STICKY_SECONDS: after a write, requests with the same bearer token (or address without one) read from
+        the primary for this many seconds so they see their own writes (default 5)
+    writes, and every read of a request or session that has written, go to the primary
+    a request sticks to the replica it picked first; without a healthy replica it reads from the primary
+    with a shared store (the redis cache backend) the sticky clients and the last write are kept there,
+    so every worker sees them; otherwise they are tracked per worker process and reading your own writes,
+    and keeping stale replica reads out of the caches, only holds for a single worker
+'''
+
+MAX_STICKY_CLIENTS = 10000
+
+
+class ReplicaSet:
+    def __init__(self):
+        self.engines = []
+        self.health_check_interval = 10
+        self.sticky_seconds = 5
+        self.last_write_at = None
+        self.store = None
+        self._health = {}
+        self._checking = set()
+        self._next = itertools.count()
+        self._sticky = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return len(self.engines) > 0
+
+    def configure(self, urls, engine_options=None, health_check_interval=10, sticky_seconds=5, make_engine=None):
+        make_engine = make_engine or create_engine
+        self.engines = []
+        for url in urls:
+            engine = make_engine(url, **(engine_options(url) if engine_options else {}))
+            event.listen(engine, 'handle_error', self._on_error)
+            self.engines.append(engine)
+        self.health_check_interval = health_check_interval
+        self.sticky_seconds = sticky_seconds
+        self._health = {}
+
+    def use_store(self, store):
+        self.store = store
+
+    def _on_error(self, context):
+        if context.is_disconnect and context.engine is not None:
+            self.mark_unhealthy(context.engine)
+
+    def mark_unhealthy(self, engine):
+        self._health[engine] = (time.monotonic(), False)
+
+    def check(self, engine):
+        try:
+            with engine.connect() as connection:
+                connection.execute('SELECT 1')
+            healthy = True
+        except Exception as e:
+            print('Replica ' + repr(engine.url) + ' failed its health check: ' + str(e))
+            healthy = False
+        self._health[engine] = (time.monotonic(), healthy)
+        return healthy
+
+    def is_healthy(self, engine):
+        checked_at, healthy = self._health.get(engine, (None, False))
+        if checked_at is not None and time.monotonic() - checked_at < self.health_check_interval:
+            return healthy
+
+        # One thread checks, the others keep using the last known state
+        with self._lock:
+            if engine in self._checking:
+                return healthy
+            self._checking.add(engine)
+        try:
+            return self.check(engine)
+        finally:
+            self._checking.discard(engine)
+
+    def choose(self):
+        start = next(self._next)
+        for offset in range(len(self.engines)):
+            engine = self.engines[(start + offset) % len(self.engines)]
+            if self.is_healthy(engine):
+                return engine
+        return None
+
+    def client_key(self):
+        identity = request.headers.get('Authorization') or request.remote_addr or ''
+        return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+    def record_write(self):
+        self.last_write_at = time.monotonic()
+        if not self.enabled:
+            return
+        ttl = int(math.ceil(self.sticky_seconds))
+        if self.store is not None:
+            # Wall clock, the monotonic clocks of different processes are not comparable
+            self.store.set('replica:last_write', repr(time.time()), ttl)
+        if not has_request_context():
+            return
+        key = self.client_key()
+        if self.store is not None:
+            self.store.set('replica:sticky:' + key, '1', ttl)
+            return
+        with self._lock:
+            self._sticky[key] = self.last_write_at + self.sticky_seconds
+            self._sticky.move_to_end(key)
+            while len(self._sticky) > MAX_STICKY_CLIENTS:
+                self._sticky.popitem(last=False)
+
+    def is_sticky(self, key):
+        if self.store is not None:
+            return self.store.get('replica:sticky:' + key) is not None
+        until = self._sticky.get(key)
+        if until is None:
+            return False
+        if time.monotonic() >= until:
+            with self._lock:
+                self._sticky.pop(key, None)
+            return False
+        return True
+
+    def engine_for_request(self):
+        '''
+        The replica the current request reads from, None for the primary
+        '''
+        if not self.enabled or not has_request_context() or request.method not in ('GET', 'HEAD'):
+            return None
+        if 'db_replica' not in g:
+            g.db_replica = None if self.is_sticky(self.client_key()) else self.choose()
+        return g.db_replica
+
+    def may_be_stale(self):
+        '''
+        True when the current request read from a replica shortly after a write (of any worker with a shared store),
+        its response should not be cached or given an etag for the new table versions
+        '''
+        if not has_request_context() or g.get('db_replica') is None:
+            return False
+        if self.store is not None:
+            written_at = self.store.get('replica:last_write')
+            return written_at is not None and time.time() - float(written_at) < self.sticky_seconds
+        if self.last_write_at is None:
+            return False
+        return time.monotonic() - self.last_write_at < self.sticky_seconds
+
+
+replica_set = ReplicaSet()
@@ -0,0 +1,196 @@
+import threading
+from collections import defaultdict
+
+from sqlalchemy import case, func, text
+
+from helpers.replicas import replica_set
+from helpers.versioning import table_versions
+
+'''
+Search backend for the actor name and movie title filters
+    postgres with pg_trgm: ILIKE '%term%' served by the GIN trigram indexes, ranked by similarity()
+    postgres without pg_trgm and other servers: a plain ILIKE '%term%' without ranking
+    sqlite (local and test runs): an in-memory trigram index kept up to date by model writes
+    and rebuilt when the table version moved without it, e.g. after writes of other workers sharing the versions
+'''
+
+# Above this many matches the in-memory index hands the filter back to the database
+MAX_INDEXED_MATCHES = 500
+
+
+def trigrams(value):
+    value = value.lower()
+    return set(value[index:index + 3] for index in range(len(value) - 2))
+
+
+def similarity(term, value):
+    '''
+    Share of trigrams both strings have in common, same idea as pg_trgm's similarity()
+    '''
+    term_grams = trigrams('  ' + term + ' ')
+    value_grams = trigrams('  ' + value + ' ')
+    union = term_grams | value_grams
+    if not union:
+        return 0.0
+    return len(term_grams & value_grams) / len(union)
+
+
+class NGramIndex:
+    def __init__(self):
+        self._postings = defaultdict(set)
+        self._texts = {}
+        self._built = False
+        self.version = None
+        self._lock = threading.RLock()
+
+    @property
+    def built(self):
+        return self._built
+
+    def build(self, rows, version=None):
+        with self._lock:
+            self._postings = defaultdict(set)
+            self._texts = {}
+            for record_id, value in rows:
+                self._add(record_id, value)
+            self._built = True
+            self.version = version
+
+    def invalidate(self):
+        with self._lock:
+            self._built = False
+            self._postings = defaultdict(set)
+            self._texts = {}
+            self.version = None
+
+    def add(self, record_id, value):
+        with self._lock:
+            self._remove(record_id)
+            self._add(record_id, value)
+
+    def remove(self, record_id):
+        with self._lock:
+            self._remove(record_id)
+
+    def search(self, term, max_matches=None):
+        '''
+        Ids whose text contains term, best matches first
+        None when there are more than max_matches of them
+        '''
+        term = term.lower()
+        grams = trigrams(term)
+        with self._lock:
+            if grams:
+                postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+                candidates = set.intersection(*postings)
+            else:
+                candidates = self._texts.keys()
+            matches = [(record_id, self._texts[record_id]) for record_id in candidates
+                       if term in self._texts[record_id]]
+
+        if max_matches is not None and len(matches) > max_matches:
+            return None
+
+        matches.sort(key=lambda match: (-similarity(term, match[1]), match[0]))
+        return [record_id for record_id, _ in matches]
+
+    def _add(self, record_id, value):
+        if value is None:
+            return
+        value = value.lower()
+        self._texts[record_id] = value
+        for gram in trigrams(value):
+            self._postings[gram].add(record_id)
+
+    def _remove(self, record_id):
+        value = self._texts.pop(record_id, None)
+        if value is None:
+            return
+        for gram in trigrams(value):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(record_id)
+                if not posting:
+                    del self._postings[gram]
+
+
+class SearchBackend:
+    def __init__(self, model, column_name):
+        self.model = model
+        self.column_name = column_name
+        self.index = NGramIndex()
+        self._trigram_support = {}
+        self._build_lock = threading.Lock()
+
+    @property
+    def column(self):
+        return getattr(self.model, self.column_name)
+
+    @property
+    def table(self):
+        return self.model.__tablename__
+
+    def uses_trigram_index(self, session):
+        bind = session.get_bind()
+        if 'postgresql' != bind.dialect.name:
+            return False
+        if bind.url not in self._trigram_support:
+            installed = session.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first()
+            self._trigram_support[bind.url] = installed is not None
+        return self._trigram_support[bind.url]
+
+    def filter(self, query, term):
+        '''
+        Restricts query to records matching term
+        returns the filtered query and the relevance ordering for it (best first)
+        '''
+        column = self.column
+        if self.uses_trigram_index(query.session):
+            return query.filter(column.ilike('%' + term + '%')), func.similarity(column, term).desc()
+        if 'sqlite' != query.session.get_bind().dialect.name:
+            # A server is shared by several workers, an index of this process would miss their writes
+            return query.filter(column.ilike('%' + term + '%')), None
+
+        self.ensure_built(query.session)
+        matches = self.index.search(term, MAX_INDEXED_MATCHES)
+        if matches is None:
+            return query.filter(column.ilike('%' + term + '%')), None
+        if not matches:
+            return query.filter(self.model.id.in_([])), None
+
+        ranking = case(dict((record_id, rank) for rank, record_id in enumerate(matches)), value=self.model.id)
+        return query.filter(self.model.id.in_(matches)), ranking.asc()
+
+    def ensure_built(self, session):
+        version = table_versions.get(self.table)
+        if self.index.built and self.index.version == version:
+            return
+        with self._build_lock:
+            if self.index.built and self.index.version == version:
+                return
+            rows = session.query(self.model.id, self.column).all()
+            # Rows read from a lagging replica are used once and rebuilt on the next search
+            self.index.build(rows, None if replica_set.may_be_stale() else version)
+
+    def on_write(self, model, action, records):
+        if model is not self.model or not self.index.built:
+            return
+
+        # The write listeners run after the version was bumped for this write, any other step means
+        # writes the index has not seen, e.g. of other workers sharing the versions
+        version = table_versions.get(self.table)
+        if self.index.version is None or version != self.index.version + 1:
+            self.index.invalidate()
+            return
+
+        for record in records:
+            record_id = getattr(record, 'id', None)
+            if record_id is None:
+                # Rows written without their primary key, rebuild on the next search
+                self.index.invalidate()
+                return
+            if 'delete' == action:
+                self.index.remove(record_id)
+            else:
+                self.index.add(record_id, getattr(record, self.column_name))
+        self.index.version = version
@@ -0,0 +1,108 @@
+import json
+import os
+from collections import OrderedDict
+
+from flask import current_app
+
+from helpers.profiling import profile_phase
+
+'''
+Serialization of listings
+    Serializer selects the columns a response needs as plain tuples instead of ORM entities
+    and turns them into dicts with a formatter compiled once per field set
+    responses are encoded with the fastest json library available (JSON_ENCODER: auto, orjson, ujson or json)
+'''
+
+
+def load_json_encoder(name=None):
+    '''
+    Returns a function encoding an object to json bytes
+    '''
+    name = name or os.environ.get('JSON_ENCODER', 'auto')
+
+    if name in ('auto', 'orjson'):
+        try:
+            import orjson
+            return orjson.dumps
+        except ImportError:
+            if 'orjson' == name:
+                raise
+
+    if name in ('auto', 'ujson'):
+        try:
+            import ujson
+            return lambda value: ujson.dumps(value, ensure_ascii=False).encode('utf-8')
+        except ImportError:
+            if 'ujson' == name:
+                raise
+
+    return lambda value: json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+json_dumps = load_json_encoder()
+
+
+def json_response(payload, status=200):
+    with profile_phase('serialize'):
+        body = json_dumps(payload)
+    return current_app.response_class(body, status=status, mimetype='application/json')
+
+
+def enum_value(value):
+    return value.value
+
+
+class Serializer:
+    def __init__(self, model, fields):
+        '''
+        fields: (output key, column name) or (output key, column name, converter) in output order
+        converters are only called for values that are not None
+        '''
+        self.model = model
+        self.fields = OrderedDict()
+        for field in fields:
+            key, column_name = field[0], field[1]
+            converter = field[2] if len(field) > 2 else None
+            self.fields[key] = (column_name, converter)
+        self.keys = tuple(self.fields.keys())
+        self._formatters = {}
+
+    def column_names(self, keys=None):
+        return [self.fields[key][0] for key in (keys or self.keys)]
+
+    def select(self, query, keys=None, extra=()):
+        '''
+        Narrows query to the columns of keys, extra column names are selected after them
+        rows keep the column names as attributes, e.g. row.id
+        '''
+        names = self.column_names(keys)
+        names += [name for name in extra if name not in names]
+        return query.with_entities(*[getattr(self.model, name) for name in names])
+
+    def formatter(self, keys=None):
+        keys = tuple(keys or self.keys)
+        formatter = self._formatters.get(keys)
+        if formatter is not None:
+            return formatter
+
+        converters = [(index, self.fields[key][1]) for index, key in enumerate(keys)
+                      if self.fields[key][1] is not None]
+        count = len(keys)
+
+        if not converters:
+            def formatter(row):
+                return dict(zip(keys, row))
+        else:
+            def formatter(row):
+                values = list(row[:count])
+                for index, converter in converters:
+                    if values[index] is not None:
+                        values[index] = converter(values[index])
+                return dict(zip(keys, values))
+
+        self._formatters[keys] = formatter
+        return formatter
+
+    def to_dicts(self, rows, keys=None):
+        with profile_phase('serialize'):
+            return list(map(self.formatter(keys), rows))
@@ -0,0 +1,79 @@
+import itertools
+
+from flask import Response, abort, stream_with_context
+
+from helpers.serialization import json_dumps
+
+'''
+Streaming responses for full table reads
+    rows are read with a server-side cursor in batches (yield_per) and written out as they arrive
+    so memory stays flat no matter how many rows the table has
+    ndjson: one json document per line
+    json: a single {"<key>": [...]} document, written element by element, extra keys follow the array
+'''
+
+EXPORT_FORMATS = ('ndjson', 'json')
+DEFAULT_BATCH_SIZE = 1000
+
+
+def get_export_format(value, default='ndjson'):
+    if value is None or '' == value:
+        return default
+    if value not in EXPORT_FORMATS:
+        abort(422)
+    return value
+
+
+def iterate_rows(query, batch_size=DEFAULT_BATCH_SIZE, not_found_when_empty=False):
+    rows = iter(query.yield_per(batch_size))
+    if not not_found_when_empty:
+        return rows
+
+    # Peek so an empty result can still be answered with 404 before streaming starts
+    first = next(rows, None)
+    if first is None:
+        abort(404)
+    return itertools.chain([first], rows)
+
+
+def format_in_batches(rows, formatter, batch_size=DEFAULT_BATCH_SIZE, embed=None):
+    '''
+    Formats rows a batch at a time so embed(records, rows) can load related data with one query per batch
+    '''
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield from _format_batch(batch, formatter, embed)
+            batch = []
+    if batch:
+        yield from _format_batch(batch, formatter, embed)
+
+
+def _format_batch(batch, formatter, embed):
+    records = [formatter(row) for row in batch]
+    if embed is not None:
+        embed(records, batch)
+    return records
+
+
+def generate_ndjson(rows, formatter):
+    for row in rows:
+        yield json_dumps(formatter(row)) + b'\n'
+
+
+def generate_json_array(rows, formatter, key, extra=None):
+    yield b'{' + json_dumps(key) + b':['
+    separator = b''
+    for row in rows:
+        yield separator + json_dumps(formatter(row))
+        separator = b','
+    yield b']' + b''.join(b',' + json_dumps(name) + b':' + json_dumps(value)
+                          for name, value in (extra or {}).items()) + b'}'
+
+
+def streamed_response(rows, formatter, key, export_format='json', extra=None):
+    if 'ndjson' == export_format:
+        return Response(stream_with_context(generate_ndjson(rows, formatter)), mimetype='application/x-ndjson')
+    return Response(stream_with_context(generate_json_array(rows, formatter, key, extra)),
+                    mimetype='application/json')
@@ -0,0 +1,56 @@
+from models import GenderEnum
+
+'''
+Validation rules shared by the single record and the bulk import endpoints
+    each validator returns the constructor arguments of the model
+    or raises ValidationError with the reason the record was rejected
+'''
+
+
+class ValidationError(ValueError):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def validate_actor(data):
+    if not isinstance(data, dict):
+        raise ValidationError('Invalid record provided')
+
+    name = data.get('name')
+    if (name is None) or (not isinstance(name, str)) or ('' == name) or (len(name) < 5):
+        raise ValidationError('Invalid name provided')
+
+    try:
+        age = int(data['age']) if 'age' in data else 0
+    except (TypeError, ValueError):
+        raise ValidationError('Invalid age provided')
+
+    if (3 > age) or (99 < age):
+        raise ValidationError('Invalid age provided')
+
+    try:
+        gender = GenderEnum(data.get('gender'))
+    except ValueError:
+        raise ValidationError('Invalid gender provided')
+
+    return {'name': name, 'age': age, 'gender': gender}
+
+
+def validate_movie(data):
+    if not isinstance(data, dict):
+        raise ValidationError('Invalid record provided')
+
+    title = data.get('title')
+    if (title is None) or (not isinstance(title, str)) or ('' == title) or (len(title) < 5):
+        raise ValidationError('Invalid title provided')
+
+    try:
+        release = int(data['releaseDate']) if 'releaseDate' in data else 0
+    except (TypeError, ValueError):
+        raise ValidationError('Invalid release provided')
+
+    if 0 == release:
+        raise ValidationError('Invalid release provided')
+
+    return {'title': title, 'release': release}
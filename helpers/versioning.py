@@ -0,0 +1,49 @@
+import threading
+import uuid
+
+'''
+TableVersions
+    a counter per table that is bumped every time rows of the table are written
+    anything derived from a table (cached counts, responses, etags) can store the version
+    it was computed at and treat a different current version as stale
+    versions live in process memory unless a shared store (e.g. the redis cache backend) is configured
+    epoch tells apart the counters of different processes, which all start at 0
+'''
+
+
+class TableVersions:
+    def __init__(self, store=None):
+        self.store = store
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._epoch = uuid.uuid4().hex[:12]
+
+    @property
+    def shared(self):
+        return self.store is not None
+
+    @property
+    def epoch(self):
+        return 'shared' if self.store is not None else self._epoch
+
+    def use_store(self, store):
+        self.store = store
+
+    def get(self, table):
+        if self.store is not None:
+            return int(self.store.get('version:' + table) or 0)
+        return self._versions.get(table, 0)
+
+    def bump(self, table):
+        if self.store is not None:
+            return self.store.incr('version:' + table)
+        with self._lock:
+            version = self._versions.get(table, 0) + 1
+            self._versions[table] = version
+            return version
+
+    def snapshot(self, tables):
+        return tuple(self.get(table) for table in tables)
+
+
+table_versions = TableVersions()
@@ -9,5 +9,13 @@ manager = Manager(app)
 
 manager.add_command('db', MigrateCommand)
 
+
+@manager.command
+def create_db():
+    '''
+    Creates the tables of the models directly, for local databases that are not managed by the migrations
+    '''
+    db.create_all()
+
 if __name__ == '__main__':
     manager.run()
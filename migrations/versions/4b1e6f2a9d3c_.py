@@ -0,0 +1,32 @@
+"""trigram search indexes
+
+Revision ID: 4b1e6f2a9d3c
+Revises: 9c47526ce47e
+Create Date: 2026-10-18 09:12:41.218630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '4b1e6f2a9d3c'
+down_revision = '9c47526ce47e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'postgresql' != op.get_bind().dialect.name:
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_Actors_name_trgm', 'Actors', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_Movies_title_trgm', 'Movies', ['title'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if 'postgresql' != op.get_bind().dialect.name:
+        return
+    op.drop_index('ix_Movies_title_trgm', table_name='Movies')
+    op.drop_index('ix_Actors_name_trgm', table_name='Actors')
@@ -0,0 +1,28 @@
+"""unique crew assignment per movie and actor
+
+Revision ID: 7d2c5e81f0ab
+Revises: 4b1e6f2a9d3c
+Create Date: 2026-10-18 10:03:27.904512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '7d2c5e81f0ab'
+down_revision = '4b1e6f2a9d3c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the oldest row of every duplicated assignment so the constraint can be created
+    op.execute('DELETE FROM "Crews" WHERE id NOT IN '
+               '(SELECT MIN(id) FROM "Crews" GROUP BY movie_id, actor_id)')
+    with op.batch_alter_table('Crews') as batch_op:
+        batch_op.create_unique_constraint('uq_Crews_movie_id_actor_id', ['movie_id', 'actor_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('Crews') as batch_op:
+        batch_op.drop_constraint('uq_Crews_movie_id_actor_id', type_='unique')
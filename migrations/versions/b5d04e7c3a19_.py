@@ -0,0 +1,24 @@
+"""index crew assignments by actor
+
+Revision ID: b5d04e7c3a19
+Revises: 7d2c5e81f0ab
+Create Date: 2026-10-18 14:21:05.318720
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b5d04e7c3a19'
+down_revision = '7d2c5e81f0ab'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # movie_id lookups use uq_Crews_movie_id_actor_id, whose leading column is movie_id
+    op.create_index('ix_Crews_actor_id', 'Crews', ['actor_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Crews_actor_id', table_name='Crews')
@@ -1,28 +1,192 @@
 import os
 import enum
-from sqlalchemy import Column, String, create_engine, Integer, BigInteger, SmallInteger, Enum
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, String, create_engine, Integer, BigInteger, SmallInteger, Enum, func
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
 import json
 import sys
 
-database_path = os.environ['DATABASE_URL']
+from helpers.versioning import table_versions
+from helpers.search import SearchBackend
+from helpers.autocomplete import AutocompleteBackend, DEFAULT_MAX_AGE as AUTOCOMPLETE_MAX_AGE
+from helpers.counters import ModelCounters
+from helpers.serialization import Serializer, enum_value
+from helpers.pooling import pool_options, make_fork_safe
+from helpers.replicas import replica_set
 
-db = SQLAlchemy()
+
+class RoutingSession(SignallingSession):
+    '''
+    Reads of GET requests go to a replica when one is configured, see helpers/replicas.py
+    once the session flushed or executed an INSERT, UPDATE or DELETE everything goes to the primary
+    '''
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+        if not self.info.get('wrote'):
+            engine = replica_set.engine_for_request()
+            if engine is not None:
+                return engine
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class Database(SQLAlchemy):
+    '''
+    SQLAlchemy whose engines drop the connections inherited from a parent process, see helpers/pooling.py
+    and whose sessions route reads to the replicas
+    '''
+
+    def create_engine(self, sa_url, engine_opts):
+        return make_fork_safe(super().create_engine(sa_url, engine_opts))
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = Database()
+
+'''
+Write listeners
+    called as listener(model, action, records) after a write through RepositoryMixin is committed
+    action is one of 'insert', 'update' or 'delete'
+'''
+
+write_listeners = []
+
+
+def on_model_write(listener):
+    write_listeners.append(listener)
+    return listener
+
+
+def notify_write(model, action, records):
+    for listener in write_listeners:
+        listener(model, action, records)
+
+
+@on_model_write
+def bump_table_version(model, action, records):
+    table_versions.bump(model.__tablename__)
+
+
+@on_model_write
+def stick_to_primary(model, action, records):
+    replica_set.record_write()
+
+
+'''
+UnitOfWork
+    collects adds, updates and deletes across models and writes them with a single commit
+    new records are inserted in bulk per model, parents before children
+    nothing is written (and the session is rolled back) when the block raises
+    write listeners run once the commit succeeded
+
+    with Actor.batch() as batch:
+        batch.add(Actor(name='Some actor', age=30))
+        batch.delete(movie)
+
+    records added without return_defaults=True do not get their ids back
+'''
+
+
+class UnitOfWork:
+    def __init__(self, return_defaults=False):
+        self.return_defaults = return_defaults
+        self._added = {}
+        self._updated = []
+        self._deleted = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def add(self, record):
+        self._added.setdefault(type(record), []).append(record)
+
+    def update(self, record):
+        self._updated.append(record)
+
+    def delete(self, record):
+        self._deleted.append(record)
+
+    def __len__(self):
+        return sum(len(records) for records in self._added.values()) + len(self._updated) + len(self._deleted)
+
+    def commit(self):
+        session = db.session
+        table_order = [table.name for table in db.metadata.sorted_tables]
+        added = sorted(self._added.items(), key=lambda item: table_order.index(item[0].__tablename__))
+
+        try:
+            for record in self._updated:
+                session.add(record)
+            for record in self._deleted:
+                session.delete(record)
+            session.flush()
+            for model, records in added:
+                session.bulk_save_objects(records, return_defaults=self.return_defaults)
+            session.commit()
+        except:
+            self.rollback()
+            raise
+
+        for model, records in _group_by_model(self._deleted):
+            notify_write(model, 'delete', records)
+        for model, records in _group_by_model(self._updated):
+            notify_write(model, 'update', records)
+        for model, records in added:
+            notify_write(model, 'insert', records)
+        self._clear()
+
+    def rollback(self):
+        db.session.rollback()
+        self._clear()
+
+    def _clear(self):
+        self._added = {}
+        self._updated = []
+        self._deleted = []
+
+
+def _group_by_model(records):
+    groups = {}
+    for record in records:
+        groups.setdefault(type(record), []).append(record)
+    return groups.items()
 
 
 class RepositoryMixin:
+    '''
+    Every method commits on its own, use batch() to group writes of several records
+    '''
+
+    @staticmethod
+    def batch(return_defaults=False):
+        return UnitOfWork(return_defaults=return_defaults)
+
     def delete_from_db(self):
         db.session.delete(self)
         db.session.commit()
+        notify_write(type(self), 'delete', [self])
 
     def update(self):
         db.session.commit()
+        notify_write(type(self), 'update', [self])
 
     def save_to_db(self):
         try:
             db.session.add(self)
             db.session.commit()
             db.session.refresh(self)
+            notify_write(type(self), 'insert', [self])
             db.session.expunge(self)
             return True
         except:
@@ -41,17 +205,34 @@ class RepositoryMixin:
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    database_path defaults to DATABASE_URL, read when the application is set up rather than on import
+    nothing connects to the database until the first query, the schema is created by the migrations
+    (python manage.py db upgrade) or by python manage.py create_db
 '''
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None):
+    database_path = database_path or os.environ['DATABASE_URL']
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    engine_options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+    for name, value in pool_options(database_path, app.config).items():
+        engine_options.setdefault(name, value)
+
+    replica_urls = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    replica_set.configure(replica_urls, lambda url: pool_options(url, app.config),
+                          float(os.environ.get('REPLICA_HEALTH_CHECK_INTERVAL', 10)),
+                          float(os.environ.get('REPLICA_STICKY_SECONDS', 5)),
+                          lambda url, **options: make_fork_safe(create_engine(url, **options)))
     db.app = app
     db.init_app(app)
-    db.create_all()
 
 
+'''
+Relationships are loaded lazily so listings do not join Crews
+listings embed related records with one query per page through embed_crew, embed_cast and load_related
+'''
+
 '''
 Person
 Have title and release year
@@ -88,7 +269,7 @@ class Movie(db.Model, RepositoryMixin):
     id = Column(Integer, primary_key=True)
     title = Column(String)
     release = Column(BigInteger)
-    crew = db.relationship('Crew', backref='Movies', lazy='joined')
+    crew = db.relationship('Crew', backref='Movies', lazy='select')
 
     def __init__(self, title, release):
         self.title = title
@@ -121,7 +302,7 @@ class Actor(db.Model, RepositoryMixin):
     name = Column(String)
     age = Column(SmallInteger)
     gender = Column(Enum(GenderEnum))
-    crew = db.relationship('Crew', backref='Actors', lazy='joined')
+    crew = db.relationship('Crew', backref='Actors', lazy='select')
 
     def __init__(self, name, age, gender=GenderEnum.Unspecified):
         self.name = name
@@ -143,8 +324,13 @@ class Crew(db.Model, RepositoryMixin):
     id = db.Column(db.Integer, primary_key=True)
     actor_id = db.Column(db.Integer, db.ForeignKey('Actors.id'))
     movie_id = db.Column(db.Integer, db.ForeignKey('Movies.id'))
-    actor = db.relationship('Actor', lazy='joined')
-    movie = db.relationship('Movie', lazy='joined')
+    actor = db.relationship('Actor', lazy='select')
+    movie = db.relationship('Movie', lazy='select')
+
+    __table_args__ = (
+        db.UniqueConstraint('movie_id', 'actor_id', name='uq_Crews_movie_id_actor_id'),
+        db.Index('ix_Crews_actor_id', 'actor_id'),
+    )
 
     def format(self):
         return {
@@ -152,3 +338,164 @@ class Crew(db.Model, RepositoryMixin):
             'movieId': self.movie_id,
             'id': self.id
         }
+
+    '''
+    assign_to_movie(movie_id, actor_ids)
+        makes actor_ids the crew of the movie in a single transaction
+        only the difference with the current crew is written, with one bulk DELETE and one bulk INSERT
+        returns the sorted actor ids that were added and removed
+    '''
+
+    @classmethod
+    def assign_to_movie(cls, movie_id, actor_ids):
+        requested = set(actor_ids)
+        try:
+            current = set(row[0] for row in db.session.query(cls.actor_id).filter(cls.movie_id == movie_id))
+            added = sorted(requested - current)
+            removed = sorted(current - requested)
+
+            if removed:
+                cls.query.filter(cls.movie_id == movie_id, cls.actor_id.in_(removed)) \
+                    .delete(synchronize_session=False)
+            if added:
+                db.session.execute(cls.__table__.insert(),
+                                   [{'movie_id': movie_id, 'actor_id': actor_id} for actor_id in added])
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+
+        if removed:
+            notify_write(cls, 'delete', [cls(movie_id=movie_id, actor_id=actor_id) for actor_id in removed])
+        if added:
+            notify_write(cls, 'insert', [cls(movie_id=movie_id, actor_id=actor_id) for actor_id in added])
+        return added, removed
+
+
+'''
+Serializers
+    same output as format() but built from selected columns instead of entities
+'''
+
+actor_serializer = Serializer(Actor, [('name', 'name'), ('age', 'age'), ('gender', 'gender', enum_value), ('id', 'id')])
+movie_serializer = Serializer(Movie, [('id', 'id'), ('title', 'title'), ('release', 'release')])
+crew_serializer = Serializer(Crew, [('actorId', 'actor_id'), ('movieId', 'movie_id'), ('id', 'id')])
+
+
+def embed_crew(records, rows, column):
+    '''
+    Adds the crew of every formatted actor or movie in records with one batched query
+    rows: the selected rows records were formatted from, they must carry the id column
+    column: Crew.actor_id or Crew.movie_id, the side records are on
+    '''
+    owner_key = 'actorId' if column is Crew.actor_id else 'movieId'
+    ids = [row.id for row in rows]
+    crews = {}
+    if ids:
+        query = Crew.query.filter(column.in_(ids)).order_by(Crew.id)
+        for crew in crew_serializer.to_dicts(crew_serializer.select(query)):
+            crews.setdefault(crew[owner_key], []).append(crew)
+
+    for record, record_id in zip(records, ids):
+        record['crew'] = crews.get(record_id, [])
+    return records
+
+
+def embed_crew_members(records, includes):
+    '''
+    Adds the actor and/or movie of every formatted crew in records, one batched query per relation
+    includes: a subset of {'actor', 'movie'}
+    '''
+    relations = [('actor', 'actorId', actor_serializer), ('movie', 'movieId', movie_serializer)]
+    for name, key, serializer in relations:
+        if name not in includes:
+            continue
+
+        ids = set(record[key] for record in records if record[key] is not None)
+        members = {}
+        if ids:
+            query = serializer.model.query.filter(serializer.model.id.in_(ids))
+            rows = serializer.select(query, extra=('id',)).all()
+            members = dict((row.id, member) for row, member in zip(rows, serializer.to_dicts(rows)))
+
+        for record in records:
+            record[name] = members.get(record[key])
+    return records
+
+
+def load_related(serializer, join_column, owner_column, owner_ids, keys=None):
+    '''
+    Loads the records of serializer's model linked to every owner id with one query through the Crews table
+    join_column: the Crew column pointing at serializer's model, e.g. Crew.actor_id for the cast of movies
+    owner_column: the Crew column holding owner_ids, e.g. Crew.movie_id
+    returns {owner id: [formatted records]} in assignment order
+    '''
+    related = {}
+    if not owner_ids:
+        return related
+
+    model = serializer.model
+    query = model.query.join(Crew, join_column == model.id).filter(owner_column.in_(owner_ids)).order_by(Crew.id)
+    formatter = serializer.formatter(keys)
+    for row in serializer.select(query, keys).add_columns(owner_column.label('owner_id')):
+        related.setdefault(row.owner_id, []).append(formatter(row))
+    return related
+
+
+def embed_cast(records, rows):
+    '''
+    Adds the actors of every formatted movie in records with one batched query
+    '''
+    ids = [row.id for row in rows]
+    cast = load_related(actor_serializer, Crew.actor_id, Crew.movie_id, ids)
+
+    for record, record_id in zip(records, ids):
+        record['cast'] = cast.get(record_id, [])
+    return records
+
+
+'''
+Search backends for the actor name and movie title filters
+'''
+
+actor_search = SearchBackend(Actor, 'name')
+movie_search = SearchBackend(Movie, 'title')
+on_model_write(actor_search.on_write)
+on_model_write(movie_search.on_write)
+
+'''
+Prefix indexes behind /api/autocomplete
+'''
+
+autocomplete_max_age = float(os.environ.get('AUTOCOMPLETE_MAX_AGE', AUTOCOMPLETE_MAX_AGE))
+actor_autocomplete = AutocompleteBackend(Actor, 'name', autocomplete_max_age)
+movie_autocomplete = AutocompleteBackend(Movie, 'title', autocomplete_max_age)
+on_model_write(actor_autocomplete.on_write)
+on_model_write(movie_autocomplete.on_write)
+
+
+'''
+Counters behind /api/stats
+    STATS_RECONCILE_INTERVAL is the number of seconds between two reconciliations with the database
+'''
+
+
+def count_models():
+    genders = dict((gender.name, 0) for gender in GenderEnum)
+    actors = 0
+    for gender, count in db.session.query(Actor.gender, func.count(Actor.id)).group_by(Actor.gender):
+        actors += count
+        if gender is not None:
+            genders[gender.name] = count
+
+    return {
+        'movies': db.session.query(func.count(Movie.id)).scalar(),
+        'actors': actors,
+        'crews': db.session.query(func.count(Crew.id)).scalar(),
+        'genders': genders
+    }
+
+
+model_counters = ModelCounters(count_models, {'Movies': 'movies', 'Actors': 'actors', 'Crews': 'crews'},
+                               reconcile_interval=int(os.environ.get('STATS_RECONCILE_INTERVAL', 300)))
+on_model_write(model_counters.on_write)
@@ -1,13 +1,42 @@
 import os
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 from unittest import TestCase, mock
 from functools import wraps
 from datetime import timezone
 import datetime
 
-from models import setup_db, Actor, GenderEnum, Movie, Crew, db
+from models import setup_db, Actor, GenderEnum, Movie, Crew, db, actor_autocomplete, actor_search
+from auth.jwks import JWKSKeyStore, KeysUnavailable
+from auth.token_cache import VerifiedTokenCache
+from helpers.pagination import encode_cursor, decode_cursor
+from helpers.counting import CountCache, count_cache, count_total
+from helpers.versioning import TableVersions
+from helpers.search import NGramIndex
+from helpers.validation import ValidationError, validate_actor
+from helpers.bulk_import import import_ndjson
+from helpers.streaming import generate_json_array, generate_ndjson, format_in_batches
+from helpers.cache import MemoryCacheBackend, RedisCacheBackend, cached_response, response_cache
+from helpers.versioning import table_versions
+from helpers.conditional import conditional_get
+from helpers.counters import ModelCounters
+from helpers.serialization import load_json_encoder
+from helpers.includes import get_fields
+from helpers.profiling import setup_profiling, profile_phase, settings as profiling_settings
+from sqlalchemy import create_engine
+from helpers.metrics import MetricsRegistry
+from helpers.pooling import pool_options
+from helpers.replicas import ReplicaSet
+from helpers.coalescing import SingleFlight, coalesced
+from helpers.autocomplete import PrefixIndex
+from models import actor_serializer
+from flask import Flask, abort, jsonify, request
+from werkzeug.exceptions import UnprocessableEntity
 
 
 def get_utc_timestamp():
@@ -35,7 +64,7 @@ def mock_decorator(permission):
 mock.patch('auth.auth.requires_auth', mock_decorator).start()
 mock.patch.dict(os.environ, {'EXCITED': 'true'})
 
-from app import create_app
+from app import create_app, RECORDS_PER_PAGE
 
 
 class CrewCase(TestCase):
@@ -51,10 +80,8 @@ class CrewCase(TestCase):
 
         # binds the app to the current context
         with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
             # create all tables
-            self.db.create_all()
+            db.create_all()
 
     def tearDown(self):
         """Executed after each test"""
@@ -82,6 +109,89 @@ class CrewCase(TestCase):
         self.assertEqual(data['success'], True)
         self.assertGreater(len(data['actors']), 0)
 
+    def test_get_actors_with_cursor(self):
+        for index in range(3):
+            Actor(name='test' + str(index), age=12, gender=GenderEnum(1)).save_to_db()
+
+        res = self.client().get('/api/actors?cursor=&perPage=2&sortField=name&sortOrder=asc')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['actors']), 2)
+        self.assertIsNotNone(data['nextCursor'])
+
+        res = self.client().get('/api/actors?cursor={}&perPage=2&sortField=name&sortOrder=asc'
+                                .format(data['nextCursor']))
+        data = json.loads(res.data)
+
+        self.assertEqual(len(data['actors']), 1)
+        self.assertEqual(data['actors'][0]['name'], 'test2')
+        self.assertIsNone(data['nextCursor'])
+
+    def test_total_count_follows_writes(self):
+        Actor(name='test1', age=12, gender=GenderEnum(1)).save_to_db()
+        res = self.client().get('/api/actors?page=1&perPage=10')
+        self.assertEqual(json.loads(res.data)['totalCount'], 1)
+
+        Actor(name='test2', age=12, gender=GenderEnum(1)).save_to_db()
+        res = self.client().get('/api/actors?page=1&perPage=10')
+        data = json.loads(res.data)
+
+        self.assertEqual(data['totalCount'], 2)
+        self.assertEqual(data['countMode'], 'exact')
+
+    def test_sort_field_overrides_relevance(self):
+        for name in ('Tom', 'Anna Tomlin', 'Tomas'):
+            Actor(name=name, age=12, gender=GenderEnum(1)).save_to_db()
+
+        res = self.client().get('/api/actors?name=tom&page=1&perPage=10&sortField=name&sortOrder=asc')
+        data = json.loads(res.data)
+
+        self.assertEqual([actor['name'] for actor in data['actors']], ['Anna Tomlin', 'Tom', 'Tomas'])
+
+    def test_autocomplete_rebuilds_after_missed_writes(self):
+        actor_autocomplete.index.invalidate()
+        Actor(name='Anna', age=12, gender=GenderEnum(1)).save_to_db()
+        with self.app.app_context():
+            actor_autocomplete.suggest('a')
+
+            # Written by another worker sharing the table versions
+            db.session.execute('INSERT INTO "Actors" (name, age, gender) VALUES (\'Bob\', 12, \'Male\')')
+            db.session.commit()
+            table_versions.bump('Actors')
+            Actor(name='Bert', age=12, gender=GenderEnum(1)).save_to_db()
+
+            self.assertEqual([text for _, text in actor_autocomplete.suggest('b')], ['Bert', 'Bob'])
+
+    def test_search_rebuilds_after_missed_writes(self):
+        actor_search.index.invalidate()
+        Actor(name='Anna Tomlin', age=12, gender=GenderEnum(1)).save_to_db()
+        self.client().get('/api/actors?name=tom&page=1&perPage=10')
+
+        # Written by another worker sharing the table versions
+        with self.app.app_context():
+            db.session.execute('INSERT INTO "Actors" (name, age, gender) VALUES (\'Tom\', 12, \'Male\')')
+            db.session.commit()
+        table_versions.bump('Actors')
+        Actor(name='Tomas', age=12, gender=GenderEnum(1)).save_to_db()
+
+        res = self.client().get('/api/actors?name=tom&page=1&perPage=10&sortField=name&sortOrder=asc')
+        self.assertEqual([actor['name'] for actor in json.loads(res.data)['actors']], ['Anna Tomlin', 'Tom', 'Tomas'])
+
+    def test_get_actors_with_crew(self):
+        Actor(name='test', age=12, gender=GenderEnum(1)).save_to_db()
+        Movie(title='test', release=get_utc_timestamp()).save_to_db()
+        Crew(actor_id=1, movie_id=1).save_to_db()
+
+        res = self.client().get('/api/actors')
+        self.assertFalse('crew' in json.loads(res.data)['actors'][0])
+
+        res = self.client().get('/api/actors?include=crew')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['actors'][0]['crew'][0]['movieId'], 1)
+
     def test_add_actor(self):
         params = json.dumps({'name': 'test1212', 'age': '12', 'gender': 1})
         res = self.client().post('/api/actors', data=params, headers={'Content-Type': 'application/json'})
@@ -96,6 +206,55 @@ class CrewCase(TestCase):
 
         self.assertEqual(res.status_code, 422)
 
+    def test_import_actors(self):
+        lines = [json.dumps({'name': 'test' + str(index), 'age': 12, 'gender': 1}) for index in range(3)]
+        lines.append(json.dumps({'name': 'test', 'age': 12, 'gender': 1}))
+        res = self.client().post('/api/actors/import?chunkSize=2', data='\n'.join(lines),
+                                 headers={'Content-Type': 'application/x-ndjson'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['imported'], 3)
+        self.assertEqual(data['errors'], [{'line': 4, 'error': 'Invalid name provided'}])
+
+    def test_export_actors(self):
+        for index in range(3):
+            Actor(name='test' + str(index), age=12, gender=GenderEnum(1)).save_to_db()
+
+        res = self.client().get('/api/actors/export')
+        lines = res.data.decode('utf-8').splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual([json.loads(line)['name'] for line in lines], ['test0', 'test1', 'test2'])
+
+    def test_get_actors_with_fields(self):
+        Actor(name='test', age=12, gender=GenderEnum(1)).save_to_db()
+
+        res = self.client().get('/api/actors?page=1&perPage=10&fields=name&include=crew')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['actors'], [{'name': 'test', 'crew': []}])
+        self.assertEqual(self.client().get('/api/actors?fields=password').status_code, 422)
+
+    def test_get_movie_cast(self):
+        for index in range(2):
+            Actor(name='test' + str(index), age=12, gender=GenderEnum(1)).save_to_db()
+        Movie(title='test', release=get_utc_timestamp()).save_to_db()
+        Crew(actor_id=2, movie_id=1).save_to_db()
+
+        res = self.client().get('/api/movies/1/cast')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([actor['name'] for actor in data['cast']], ['test1'])
+        self.assertEqual(json.loads(self.client().get('/api/actors/1/movies').data)['movies'], [])
+        self.assertEqual(self.client().get('/api/movies/2/cast').status_code, 404)
+
+        res = self.client().get('/api/movies?page=1&sortField=id&sortOrder=asc&include=cast')
+        self.assertEqual(json.loads(res.data)['movies'][0]['cast'], data['cast'])
+
     def test_get_no_movies(self):
         res = self.client().get('/api/movies?sortField=release&sortOrder=asc')
 
@@ -115,6 +274,11 @@ class CrewCase(TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertGreater(len(data['movies']), 0)
 
+    def test_empty_movie_cursor_page(self):
+        res = self.client().get('/api/movies?cursor=&perPage=2&sortField=title&sortOrder=asc')
+
+        self.assertEqual(res.status_code, 404)
+
     def test_add_movie_failed(self):
         params = json.dumps({'title': 'test'})
         res = self.client().post('/api/movies', data=params, headers={'Content-Type': 'application/json'})
@@ -140,6 +304,73 @@ class CrewCase(TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertGreater(len(data['crews']), 0)
 
+    def test_get_crews_without_paging_returns_all(self):
+        for index in range(RECORDS_PER_PAGE + 1):
+            Actor(name='test' + str(index), age=12, gender=GenderEnum(1)).save_to_db()
+        Movie(title='test', release=get_utc_timestamp()).save_to_db()
+        for index in range(RECORDS_PER_PAGE + 1):
+            Crew(actor_id=index + 1, movie_id=1).save_to_db()
+
+        for path in ('/api/crews', '/api/crews?perPage=0&include=actor'):
+            data = json.loads(self.client().get(path).data)
+
+            self.assertEqual(len(data['crews']), RECORDS_PER_PAGE + 1)
+            self.assertTrue(data['success'])
+        self.assertEqual(data['crews'][0]['actor']['name'], 'test0')
+
+    def test_get_crews_filtered(self):
+        for index in range(2):
+            Actor(name='test' + str(index), age=12, gender=GenderEnum(1)).save_to_db()
+        Movie(title='test', release=get_utc_timestamp()).save_to_db()
+        Crew(actor_id=1, movie_id=1).save_to_db()
+        Crew(actor_id=2, movie_id=1).save_to_db()
+
+        res = self.client().get('/api/crews?actor_id=2&include=actor,movie&page=1')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['totalCount'], 1)
+        self.assertEqual(data['crews'][0]['actor']['name'], 'test1')
+        self.assertEqual(data['crews'][0]['movie']['title'], 'test')
+
+        res = self.client().get('/api/crews?movie_id=1&cursor=&perPage=1')
+        data = json.loads(res.data)
+        self.assertEqual([crew['actorId'] for crew in data['crews']], [1])
+        self.assertIsNotNone(data['nextCursor'])
+
+    def test_assign_crew_reports_difference(self):
+        for index in range(3):
+            Actor(name='test' + str(index), age=12, gender=GenderEnum(1)).save_to_db()
+        Movie(title='test', release=get_utc_timestamp()).save_to_db()
+        headers = {'Content-Type': 'application/json'}
+
+        self.client().post('/api/crews', data=json.dumps({'artists': [1, 2], 'movie_id': 1}), headers=headers)
+        res = self.client().post('/api/crews', data=json.dumps({'artists': [2, 3], 'movie_id': 1}), headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['added'], [3])
+        self.assertEqual(data['removed'], [1])
+        with self.app.app_context():
+            self.assertEqual(sorted(crew.actor_id for crew in Crew.query.all()), [2, 3])
+
+    def test_batch_writes_in_one_commit(self):
+        with self.app.app_context():
+            with Actor.batch(return_defaults=True) as batch:
+                batch.add(Movie(title='test', release=get_utc_timestamp()))
+                for index in range(3):
+                    batch.add(Actor(name='test' + str(index), age=12, gender=GenderEnum(1)))
+
+            self.assertEqual(Actor.query.count(), 3)
+            self.assertEqual(Movie.query.count(), 1)
+
+            with self.assertRaises(RuntimeError):
+                with Actor.batch() as batch:
+                    batch.delete(Actor.query.first())
+                    raise RuntimeError('abort the batch')
+
+            self.assertEqual(Actor.query.count(), 3)
+
     def test_add_crew_failed(self):
         params = json.dumps({'artists': None, 'movie_id': 1})
         res = self.client().post('/api/crews', data=params, headers={'Content-Type': 'application/json'})
@@ -147,6 +378,646 @@ class CrewCase(TestCase):
         self.assertEqual(res.status_code, 422)
 
 
+class JWKSKeyStoreCase(TestCase):
+    """Checks the in-process JWKS cache against a local jwks file"""
+
+    def setUp(self):
+        self.jwks_file = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+        self.write_keys(['key-1'])
+        self.store = JWKSKeyStore('file://' + self.jwks_file.name, ttl=600, min_refresh_interval=30)
+        self.fetch_count = 0
+        original_fetch = self.store.fetch
+
+        def counting_fetch():
+            self.fetch_count += 1
+            return original_fetch()
+
+        self.store.fetch = counting_fetch
+
+    def tearDown(self):
+        os.unlink(self.jwks_file.name)
+
+    def write_keys(self, kids):
+        with open(self.jwks_file.name, 'w') as jwks_file:
+            json.dump({'keys': [{'kty': 'RSA', 'kid': kid, 'use': 'sig', 'n': 'AQAB', 'e': 'AQAB'} for kid in kids]},
+                      jwks_file)
+
+    def test_keys_are_fetched_once(self):
+        self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+        self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+        self.assertEqual(self.fetch_count, 1)
+
+    def test_unknown_kid_refetches_once(self):
+        self.store.get_key('key-1')
+        self.write_keys(['key-1', 'key-2'])
+        self.store._last_attempt -= 60
+
+        self.assertEqual(self.store.get_key('key-2')['kid'], 'key-2')
+        self.assertIsNone(self.store.get_key('key-3'))
+        self.assertIsNone(self.store.get_key('key-4'))
+        self.assertEqual(self.fetch_count, 2)
+
+    def test_stale_keys_refresh_in_background(self):
+        self.store.get_key('key-1')
+        self.write_keys(['key-2'])
+        self.store._fetched_at -= 601
+        self.store._last_attempt -= 601
+
+        self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+        self.store._background_refresh.join()
+        self.assertEqual(self.store.get_key('key-2')['kid'], 'key-2')
+        self.assertEqual(self.fetch_count, 2)
+
+    def test_failed_first_fetch_is_rate_limited(self):
+        os.unlink(self.jwks_file.name)
+        for _ in range(3):
+            with self.assertRaises(KeysUnavailable):
+                self.store.get_key('key-1')
+        self.assertEqual(self.fetch_count, 1)
+
+        self.write_keys(['key-1'])
+        self.store._last_attempt -= 60
+        self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+        self.assertEqual(self.fetch_count, 2)
+
+
+class VerifiedTokenCacheCase(TestCase):
+    """Checks the LRU cache of verified tokens"""
+
+    def setUp(self):
+        self.cache = VerifiedTokenCache(max_size=2)
+        self.exp = get_utc_timestamp() + 3600
+
+    def test_hit_after_put(self):
+        self.assertIsNone(self.cache.get('token-1'))
+        self.cache.put('token-1', {'exp': self.exp, 'permissions': ['view:actors']})
+
+        self.assertEqual(self.cache.get('token-1')['permissions'], ['view:actors'])
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_expired_token_is_a_miss(self):
+        self.cache.put('token-1', {'exp': get_utc_timestamp() - 1})
+
+        self.assertIsNone(self.cache.get('token-1'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_least_recently_used_is_evicted(self):
+        for token in ('token-1', 'token-2'):
+            self.cache.put(token, {'exp': self.exp})
+        self.cache.get('token-1')
+        self.cache.put('token-3', {'exp': self.exp})
+
+        self.assertIsNotNone(self.cache.get('token-1'))
+        self.assertIsNone(self.cache.get('token-2'))
+
+
+class CursorCase(TestCase):
+    """Checks the opaque keyset pagination cursors"""
+
+    def test_round_trip(self):
+        cursor = encode_cursor('gender', 'desc', GenderEnum.Female, 42)
+
+        self.assertEqual(decode_cursor(cursor, 'gender', 'desc'), ('Female', 42))
+        self.assertIsNone(decode_cursor('', 'gender', 'desc'))
+
+    def test_cursor_for_other_ordering_is_rejected(self):
+        cursor = encode_cursor('name', 'asc', 'test', 1)
+
+        with self.assertRaises(UnprocessableEntity):
+            decode_cursor(cursor, 'name', 'desc')
+        with self.assertRaises(UnprocessableEntity):
+            decode_cursor('not-a-cursor', 'name', 'asc')
+
+
+class CountCacheCase(TestCase):
+    """Checks that cached counts are tied to table versions"""
+
+    def test_count_is_stale_after_version_bump(self):
+        versions = TableVersions()
+        cache = CountCache()
+        cache.put(('Actors', ()), versions.get('Actors'), 5)
+
+        self.assertEqual(cache.get(('Actors', ()), versions.get('Actors')), 5)
+        versions.bump('Actors')
+        self.assertIsNone(cache.get(('Actors', ()), versions.get('Actors')))
+
+    def test_count_from_a_lagging_replica_is_not_cached(self):
+        with mock.patch('helpers.counting.exact_count', return_value=3), \
+                mock.patch('helpers.counting.replica_set.may_be_stale', return_value=True):
+            self.assertEqual(count_total(None, Actor, ('stale',)), (3, 'exact'))
+
+        self.assertIsNone(count_cache.get(('Actors', ('stale',)), table_versions.get('Actors')))
+
+    def test_count_expires_after_ttl(self):
+        cache = CountCache(ttl=0.05)
+        cache.put(('Actors', ()), 0, 5)
+
+        self.assertEqual(cache.get(('Actors', ()), 0), 5)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get(('Actors', ()), 0))
+
+
+class NGramIndexCase(TestCase):
+    """Checks the in-memory trigram index used when pg_trgm is not available"""
+
+    def setUp(self):
+        self.index = NGramIndex()
+        self.index.build([(1, 'Tom Hanks'), (2, 'Tom Cruise'), (3, 'Hank Azaria'), (4, 'Anna Tomlin')])
+
+    def test_matches_are_ranked(self):
+        self.assertEqual(self.index.search('tom'), [1, 2, 4])
+        self.assertEqual(self.index.search('HANK'), [3, 1])
+        self.assertEqual(self.index.search('xyz'), [])
+
+    def test_writes_update_the_index(self):
+        self.index.add(3, 'Hanna Azaria')
+        self.index.remove(1)
+
+        self.assertEqual(self.index.search('hank'), [])
+        self.assertEqual(self.index.search('tom', max_matches=1), None)
+
+
+class BulkImportCase(TestCase):
+    """Checks the NDJSON import loop without a database"""
+
+    class Record:
+        batches = []
+
+        def __init__(self, **fields):
+            self.fields = fields
+
+        @classmethod
+        def batch(cls):
+            batch = mock.MagicMock()
+            batch.__enter__.return_value = batch
+            cls.batches.append(batch)
+            return batch
+
+    def setUp(self):
+        self.Record.batches = []
+
+    def test_valid_lines_are_written_in_chunks(self):
+        lines = [json.dumps({'name': 'test' + str(index), 'age': 12, 'gender': 1}).encode() for index in range(5)]
+        report = import_ndjson(lines, self.Record, validate_actor, chunk_size=2)
+
+        self.assertEqual(report.imported, 5)
+        self.assertEqual(len(self.Record.batches), 3)
+
+    def test_invalid_lines_are_reported(self):
+        lines = [b'{"name": "tester", "age": 12, "gender": 1}', b'', b'{not json', b'{"name": "tester", "age": 120}']
+        report = import_ndjson(lines, self.Record, validate_actor)
+
+        self.assertEqual(report.imported, 1)
+        self.assertEqual(report.format()['errors'], [{'line': 3, 'error': 'Invalid JSON provided'},
+                                                     {'line': 4, 'error': 'Invalid age provided'}])
+
+    def test_validation_rules(self):
+        self.assertEqual(validate_actor({'name': 'tester', 'age': '12', 'gender': 2})['age'], 12)
+        with self.assertRaises(ValidationError):
+            validate_actor({'name': 'tester', 'age': 12, 'gender': 5})
+
+
+class StreamingCase(TestCase):
+    """Checks the generators behind the streamed exports"""
+
+    def test_json_array_is_valid_json(self):
+        body = b''.join(generate_json_array(iter([1, 2, 3]), lambda value: {'id': value}, 'movies'))
+
+        self.assertEqual(json.loads(body), {'movies': [{'id': 1}, {'id': 2}, {'id': 3}]})
+        self.assertEqual(json.loads(b''.join(generate_json_array(iter([]), str, 'movies'))), {'movies': []})
+        body = b''.join(generate_json_array(iter([1]), lambda value: {'id': value}, 'crews', {'success': True}))
+        self.assertEqual(json.loads(body), {'crews': [{'id': 1}], 'success': True})
+
+    def test_ndjson_has_one_record_per_line(self):
+        body = b''.join(generate_ndjson(iter([1, 2]), lambda value: {'id': value}))
+
+        self.assertEqual(body, b'{"id":1}\n{"id":2}\n')
+
+    def test_batches_are_embedded_together(self):
+        batches = []
+
+        def embed(records, rows):
+            batches.append(list(rows))
+
+        records = list(format_in_batches(iter([1, 2, 3]), lambda value: {'id': value}, 2, embed))
+
+        self.assertEqual(records, [{'id': 1}, {'id': 2}, {'id': 3}])
+        self.assertEqual(batches, [[1, 2], [3]])
+
+
+class FakeRedis:
+    """Minimal stand-in for redis-py's client"""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value if isinstance(value, bytes) else str(value).encode('utf-8')
+
+    def incr(self, key):
+        value = int(self.values.get(key, b'0')) + 1
+        self.values[key] = str(value).encode('utf-8')
+        return value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+class ResponseCacheCase(TestCase):
+    """Checks the response cache with both backends"""
+
+    def setUp(self):
+        self.calls = 0
+        self.app = Flask(__name__)
+
+        @self.app.route('/items')
+        @cached_response('Items')
+        def items():
+            self.calls += 1
+            return jsonify({'calls': self.calls})
+
+    def tearDown(self):
+        response_cache.configure(None)
+        table_versions.use_store(None)
+
+    def check_backend(self, backend):
+        response_cache.configure(backend)
+        client = self.app.test_client()
+
+        self.assertEqual(json.loads(client.get('/items?b=2&a=1').data)['calls'], 1)
+        self.assertEqual(json.loads(client.get('/items?a=1&b=2').data)['calls'], 1)
+        self.assertEqual(json.loads(client.get('/items?a=2').data)['calls'], 2)
+
+        table_versions.bump('Items')
+        self.assertEqual(json.loads(client.get('/items?a=1&b=2').data)['calls'], 3)
+
+    def test_memory_backend(self):
+        self.check_backend(MemoryCacheBackend())
+
+    def test_redis_backend(self):
+        backend = RedisCacheBackend(FakeRedis())
+        table_versions.use_store(backend)
+
+        self.check_backend(backend)
+        self.assertEqual(backend.client.get('fsnd:version:Items'), b'1')
+
+    def test_memory_backend_evicts_least_recently_used(self):
+        backend = MemoryCacheBackend(max_entries=2)
+        backend.set('a', 1)
+        backend.set('b', 2)
+        backend.get('a')
+        backend.set('c', 3)
+
+        self.assertEqual(backend.get('a'), 1)
+        self.assertIsNone(backend.get('b'))
+
+
+class ConditionalGetCase(TestCase):
+    """Checks ETag based 304 responses"""
+
+    def setUp(self):
+        self.calls = 0
+        self.app = Flask(__name__)
+
+        @self.app.route('/items')
+        @conditional_get('Items')
+        def items():
+            self.calls += 1
+            return jsonify({'calls': self.calls})
+
+        table_versions.use_store(RedisCacheBackend(FakeRedis()))
+
+    def tearDown(self):
+        table_versions.use_store(None)
+
+    def test_matching_etag_skips_the_endpoint(self):
+        client = self.app.test_client()
+        etag = client.get('/items').headers['ETag']
+        res = client.get('/items', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(self.calls, 1)
+
+    def test_write_changes_the_etag(self):
+        client = self.app.test_client()
+        etag = client.get('/items').headers['ETag']
+        table_versions.bump('Items')
+        res = client.get('/items', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_no_etag_without_shared_versions(self):
+        table_versions.use_store(None)
+        res = self.app.test_client().get('/items')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('ETag', res.headers)
+
+
+class ModelCountersCase(TestCase):
+    """Checks the incrementally maintained stats counters"""
+
+    def setUp(self):
+        self.loads = 0
+
+        def load():
+            self.loads += 1
+            return {'movies': 1, 'actors': 1, 'crews': 0, 'genders': {'Male': 1, 'Female': 0, 'Unspecified': 0}}
+
+        self.counters = ModelCounters(load, {'Actors': 'actors', 'Movies': 'movies', 'Crews': 'crews'})
+
+    def test_inserts_and_deletes_are_counted(self):
+        self.counters.snapshot()
+        self.counters.on_write(Actor, 'insert', [Actor(name='test1', age=12, gender=GenderEnum(2))])
+        self.counters.on_write(Movie, 'delete', [Movie(title='test', release=1)])
+        snapshot = self.counters.snapshot()
+
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(snapshot['actors'], 2)
+        self.assertEqual(snapshot['movies'], 0)
+        self.assertEqual(snapshot['genders']['Female'], 1)
+
+    def test_updates_force_a_reconcile(self):
+        self.counters.snapshot()
+        self.counters.on_write(Actor, 'update', [Actor(name='test1', age=12)])
+        self.counters.snapshot()
+
+        self.assertEqual(self.loads, 2)
+
+    def test_counts_from_a_lagging_replica_are_reloaded(self):
+        with mock.patch('helpers.counters.replica_set.may_be_stale', return_value=True):
+            self.counters.snapshot()
+        self.counters.snapshot()
+        self.counters.snapshot()
+
+        self.assertEqual(self.loads, 2)
+
+
+class SerializerCase(TestCase):
+    """Checks the column based serializers against format()"""
+
+    def test_rows_match_format(self):
+        actor = Actor(name='test1', age=12, gender=GenderEnum(2))
+        actor.id = 7
+        row = (actor.name, actor.age, actor.gender, actor.id)
+
+        self.assertEqual(actor_serializer.to_dicts([row]), [actor.format()])
+        self.assertIs(actor_serializer.formatter(), actor_serializer.formatter())
+
+    def test_extra_columns_are_not_serialized(self):
+        formatter = actor_serializer.formatter(('id', 'name'))
+
+        self.assertEqual(formatter((7, 'test1', 12)), {'id': 7, 'name': 'test1'})
+
+    def test_fields_are_parsed_in_order(self):
+        with Flask(__name__).test_request_context('/?fields=name,id,name'):
+            self.assertEqual(get_fields(actor_serializer.keys), ('name', 'id'))
+        with Flask(__name__).test_request_context('/?fields=name,password'):
+            with self.assertRaises(UnprocessableEntity):
+                get_fields(actor_serializer.keys)
+        with Flask(__name__).test_request_context('/'):
+            self.assertIsNone(get_fields(actor_serializer.keys))
+
+    def test_stdlib_encoder(self):
+        self.assertEqual(load_json_encoder('json')({'id': 1, 'name': 'test'}), b'{"id":1,"name":"test"}')
+
+
+class ProfilingCase(TestCase):
+    """Checks the Server-Timing instrumentation"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        engine = create_engine('sqlite://')
+
+        @self.app.route('/profiled')
+        def profiled():
+            with profile_phase('auth'):
+                engine.execute('SELECT 1').fetchall()
+            engine.execute('SELECT 2').fetchall()
+            return 'ok'
+
+    def tearDown(self):
+        profiling_settings['enabled'] = False
+
+    def test_phases_are_reported(self):
+        with mock.patch.dict(os.environ, {'PROFILE_REQUESTS': 'true'}):
+            setup_profiling(self.app)
+        timing = self.app.test_client().get('/profiled').headers['Server-Timing']
+
+        self.assertTrue(timing.startswith('auth;dur='))
+        self.assertIn('desc="2 statements"', timing)
+
+    def test_disabled_by_default(self):
+        with mock.patch.dict(os.environ, {'PROFILE_REQUESTS': 'false'}):
+            setup_profiling(self.app)
+
+        self.assertNotIn('Server-Timing', self.app.test_client().get('/profiled').headers)
+
+
+class MetricsCase(TestCase):
+    """Checks the metrics registry and its text exposition"""
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.registry.counter('requests_total', 'Requests')
+        self.registry.histogram('latency_seconds', 'Latency', (0.1, 1.0))
+
+    def test_histogram_buckets_are_cumulative(self):
+        self.registry.configure(None)
+        for value in (0.05, 0.5, 5.0):
+            self.registry.observe('latency_seconds', (('route', '/api/actors'),), value)
+        text = self.registry.exposition()
+
+        self.assertIn('latency_seconds_bucket{route="/api/actors",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{route="/api/actors",le="1.0"} 2', text)
+        self.assertIn('latency_seconds_bucket{route="/api/actors",le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_count{route="/api/actors"} 3', text)
+
+    def test_snapshots_of_all_processes_are_added_up(self):
+        directory = tempfile.mkdtemp()
+        with open(os.path.join(directory, 'metrics_1.json'), 'w') as snapshot_file:
+            json.dump([['requests_total', [['status', '200']], 2]], snapshot_file)
+        self.registry.configure(directory)
+        self.registry.inc('requests_total', (('status', '200'),))
+
+        self.assertIn('requests_total{status="200"} 3', self.registry.exposition())
+
+    def test_gauges_of_exited_workers_are_dropped(self):
+        worker = subprocess.Popen([sys.executable, '-c', 'pass'])
+        worker.wait()
+        directory = tempfile.mkdtemp()
+        with open(os.path.join(directory, 'metrics_%d.json' % worker.pid), 'w') as snapshot_file:
+            json.dump([['requests_total', [], 2], ['connections', [], 5]], snapshot_file)
+        self.registry.gauge('connections', 'Connections')
+        self.registry.configure(directory)
+        self.registry.add_collector(lambda: {('connections', ()): 1})
+        text = self.registry.exposition()
+
+        self.assertIn('requests_total 2', text)
+        self.assertIn('connections 1', text)
+
+
+class PoolOptionsCase(TestCase):
+    """Checks the engine options derived from the pool settings"""
+
+    def test_config_overrides_environment(self):
+        with mock.patch.dict(os.environ, {'DB_POOL_SIZE': '3', 'DB_STATEMENT_TIMEOUT_MS': '5000'}):
+            options = pool_options('postgresql://localhost/capstone', {'DB_POOL_SIZE': 8})
+
+        self.assertEqual(options['pool_size'], 8)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['connect_args'], {'options': '-c statement_timeout=5000'})
+
+    def test_sqlite_keeps_its_pool(self):
+        self.assertEqual(pool_options('sqlite://', {}), {})
+
+
+class ReplicaSetCase(TestCase):
+    """Checks replica selection and the sticky primary window"""
+
+    def setUp(self):
+        self.replicas = ReplicaSet()
+        self.replicas.configure(['sqlite://', 'sqlite:///' + tempfile.mkdtemp() + '/missing/replica.db'])
+        self.app = Flask(__name__)
+
+    def test_unhealthy_replicas_are_skipped(self):
+        with self.app.test_request_context('/api/actors'):
+            chosen = set(self.replicas.choose() for _ in range(4))
+
+        self.assertEqual(chosen, {self.replicas.engines[0]})
+
+    def test_client_reads_from_primary_after_a_write(self):
+        headers = {'Authorization': 'Bearer writer'}
+        with self.app.test_request_context('/api/actors', method='POST', headers=headers):
+            self.assertIsNone(self.replicas.engine_for_request())
+            self.replicas.record_write()
+        with self.app.test_request_context('/api/actors', headers=headers):
+            self.assertIsNone(self.replicas.engine_for_request())
+            self.assertFalse(self.replicas.may_be_stale())
+        with self.app.test_request_context('/api/actors', headers={'Authorization': 'Bearer reader'}):
+            self.assertIs(self.replicas.engine_for_request(), self.replicas.engines[0])
+            self.assertTrue(self.replicas.may_be_stale())
+
+    def test_shared_store_makes_writes_visible_to_other_workers(self):
+        store = RedisCacheBackend(FakeRedis())
+        other_worker = ReplicaSet()
+        other_worker.configure(['sqlite://'])
+        for replicas in (self.replicas, other_worker):
+            replicas.use_store(store)
+
+        headers = {'Authorization': 'Bearer writer'}
+        with self.app.test_request_context('/api/actors', method='POST', headers=headers):
+            self.replicas.record_write()
+        with self.app.test_request_context('/api/actors', headers=headers):
+            self.assertIsNone(other_worker.engine_for_request())
+        with self.app.test_request_context('/api/actors', headers={'Authorization': 'Bearer reader'}):
+            self.assertIs(other_worker.engine_for_request(), other_worker.engines[0])
+            self.assertTrue(other_worker.may_be_stale())
+
+
+class CoalescingCase(TestCase):
+    """Checks that concurrent identical reads share one endpoint call"""
+
+    def setUp(self):
+        self.calls = 0
+        self.app = Flask(__name__)
+
+        @self.app.route('/items')
+        @coalesced('Items')
+        def items():
+            self.calls += 1
+            time.sleep(0.2)
+            return jsonify({'page': request.args.get('page')})
+
+        @self.app.route('/failing')
+        @coalesced('Items')
+        def failing():
+            self.calls += 1
+            time.sleep(0.2)
+            abort(503)
+
+    def get_concurrently(self, urls):
+        responses = [None] * len(urls)
+
+        def get(index):
+            responses[index] = self.app.test_client().get(urls[index])
+
+        threads = [threading.Thread(target=get, args=(index,)) for index in range(len(urls))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_identical_requests_share_the_response(self):
+        responses = self.get_concurrently(['/items?page=1'] * 4)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual([json.loads(res.data) for res in responses], [{'page': '1'}] * 4)
+
+    def test_different_arguments_are_not_shared(self):
+        self.get_concurrently(['/items?page=1', '/items?page=2'])
+
+        self.assertEqual(self.calls, 2)
+
+    def test_followers_get_their_own_error(self):
+        errors = []
+        flight = SingleFlight()
+
+        def failing():
+            time.sleep(0.2)
+            raise RuntimeError('database timeout')
+
+        def run():
+            try:
+                flight.run('key', failing)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(type(error).__name__ for error in errors),
+                         ['CoalescedError', 'CoalescedError', 'RuntimeError'])
+        leader = [error for error in errors if isinstance(error, RuntimeError)][0]
+        self.assertTrue(all(error.__cause__ is leader for error in errors if error is not leader))
+        self.assertEqual(len(set(map(id, errors))), 3)
+
+    def test_followers_share_the_leaders_error(self):
+        responses = self.get_concurrently(['/failing'] * 4)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual([res.status_code for res in responses], [503] * 4)
+
+
+class PrefixIndexCase(TestCase):
+    """Checks the sorted prefix index behind /api/autocomplete"""
+
+    def setUp(self):
+        self.index = PrefixIndex()
+        self.index.build([(1, 'Tom Hanks'), (2, 'Tom Cruise'), (3, 'Hank Azaria'), (4, 'Anna Tomlin')])
+
+    def test_whole_text_matches_come_first(self):
+        self.assertEqual(self.index.search('han'), [(3, 'Hank Azaria'), (1, 'Tom Hanks')])
+        self.assertEqual(self.index.search('TOM', 2), [(2, 'Tom Cruise'), (1, 'Tom Hanks')])
+        self.assertEqual(self.index.search('tom h'), [(1, 'Tom Hanks')])
+
+    def test_writes_update_the_index(self):
+        self.index.add(5, 'Tom Holland')
+        self.index.add(1, 'Thomas Hanks')
+        self.index.remove(2)
+
+        self.assertEqual(self.index.search('tom'), [(5, 'Tom Holland'), (4, 'Anna Tomlin')])
+        self.assertEqual(self.index.search('hanks'), [(1, 'Thomas Hanks')])
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()